@@ -7,18 +7,29 @@ import json
 import logging
 import threading
 import random
-from contextlib import contextmanager
-from datetime import datetime, timezone
-
-import requests
+import itertools
+import atexit
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+
+from cachetools import LRUCache
+try:
+    import orjson
+except ImportError:  # opcional: sem orjson, o Flask usa o json da stdlib
+    orjson = None
 from flask import Flask, render_template, jsonify, request, make_response
+from flask.json.provider import DefaultJSONProvider
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError, IntegrityError
-from sqlalchemy import text
-from twilio.rest import Client
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import load_only, raiseload
 
 # Importamos funções auxiliares
-from utils import check_link, check_token, check_probe, check_webhook, log_event
-from models import db, Bot
+from utils import (
+    check_link, check_token, check_probe, check_webhook, log_event,
+    warm_up_telegram, invalidate_health_cache, is_token_well_formed,
+    enqueue_whatsapp, flush_whatsapp_queue, requests_session, diag_timeouts_total,
+)
+from models import db, Bot, now_utc, as_utc, health_mask  # now_utc: fonte única do relógio UTC (timezone-aware)
 
 # ================================
 # Configuração de logging
@@ -48,21 +59,51 @@ MAX_LOGS = int(os.getenv("MAX_LOGS", "500"))
 STARTUP_GRACE_SECONDS = int(os.getenv("STARTUP_GRACE_SECONDS", "15"))
 DOUBLECHECK_DELAY_SECONDS = int(os.getenv("DOUBLECHECK_DELAY_SECONDS", "5"))
 RETRY_CHECKS_PER_PASS = int(os.getenv("RETRY_CHECKS_PER_PASS", "1"))
+# Backoff exponencial com full jitter nas tentativas extras: min(cap, base * 2^n), sorteado em [0, x]
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))
+RETRY_BACKOFF_CAP = float(os.getenv("RETRY_BACKOFF_CAP", "30"))
 HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "8.0"))
 MONITOR_ENABLED = os.getenv("MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+# Patch do schema no boot; desligue (false) quando as migrations do Alembic rodam no deploy
+SCHEMA_BOOTSTRAP = os.getenv("SCHEMA_BOOTSTRAP", "true").lower() in ("1", "true", "yes")
+# A checagem da redirect_url é só informativa (não entra na decisão); desligável para poupar rede
+LINK_CHECK_ENABLED = os.getenv("LINK_CHECK_ENABLED", "true").lower() in ("1", "true", "yes")
+MONITOR_MAX_WORKERS = int(os.getenv("MONITOR_MAX_WORKERS", "8"))
+MAX_TRACKED_BOTS = int(os.getenv("MAX_TRACKED_BOTS", "1024"))
+# Intervalo de "ping" ao api.telegram.org no ócio entre ciclos: mantém o TLS vivo
+# (o edge do Telegram fecha conexões ociosas perto dos 60s do MONITOR_INTERVAL)
+TELEGRAM_KEEPALIVE_SECONDS = float(os.getenv("TELEGRAM_KEEPALIVE_SECONDS", "30"))
+# Bot saudável e inalterado só tem last_ok/updated_at regravados a cada N segundos
+HEALTHY_REFRESH_SECONDS = int(os.getenv("HEALTHY_REFRESH_SECONDS", str(MONITOR_INTERVAL * 10)))
+# Fração do MONITOR_INTERVAL disponível para as checagens do ciclo (as_completed com timeout)
+CHECK_BUDGET_RATIO = min(0.95, max(0.1, float(os.getenv("CHECK_BUDGET_RATIO", "0.8"))))
 
 DASHBOARD_ALLOW_ORIGIN = os.getenv("DASHBOARD_ALLOW_ORIGIN", "*")  # CORS simples
 
-# ================================
-# Helpers de tempo (UTC timezone-aware)
-# ================================
-def now_utc():
-    return datetime.now(timezone.utc)
-
 # ================================
 # Setup Flask
 # ================================
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON via orjson (C): jsonify() continua igual, mas serializa direto para bytes,
+    sem o passo dict -> str -> bytes do json da stdlib.
+    """
+    option = (orjson.OPT_NON_STR_KEYS if orjson else 0)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__, template_folder="templates")  # mantém templates/
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 app.secret_key = os.getenv("SECRET_KEY", "change_me")
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -70,24 +111,51 @@ if not DATABASE_URL:
 
 app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db.init_app(app)
 
-# ================================
-# Setup Twilio
-# ================================
-twilio_client = None
-if TWILIO_SID and TWILIO_AUTH:
-    twilio_client = Client(TWILIO_SID, TWILIO_AUTH)
+# Pool de conexões: dimensionado para monitor (fan-out) + tráfego da API,
+# com pre_ping para descartar conexões mortas após quedas de rede do Postgres.
+# Atenção: (DB_POOL_SIZE + DB_MAX_OVERFLOW) x workers do gunicorn precisa ficar
+# abaixo do max_connections do Postgres.
+# Teto por statement nas conexões do app (0 desliga); o bootstrap do schema roda sem ele
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "3000"))
+_engine_options = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": True,
+}
+if DATABASE_URL.startswith(("postgres://", "postgresql")):
+    _engine_options["connect_args"] = {
+        "connect_timeout": 5, "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+    }
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = _engine_options
+db.init_app(app)
 
 # ================================
 # Estruturas globais
 # ================================
-monitor_logs = []
-metrics = {"checks_total": 0, "failures_total": 0, "switches_total": 0, "last_check_ts": None}
-diag_cache = {}
-alert_state = {}
+# buffer circular de (seq, linha): append O(1), descarta o mais antigo sozinho;
+# o seq crescente permite ao cliente pedir só o que é novo (/api/logs?since=N)
+monitor_logs = deque(maxlen=MAX_LOGS)
+_log_seq = itertools.count(1)
+metrics = {"checks_total": 0, "failures_total": 0, "switches_total": 0, "check_timeouts_total": 0, "last_check_ts": None}
+_metrics_lock = threading.Lock()  # monitor e requests (force_swap) incrementam em paralelo
+# LRU limitado: IDs de bots excluídos deixam de ocupar memória indefinidamente.
+# Todo acesso (inclusive leitura, que reordena a LRU) acontece sob _state_lock.
+diag_cache = LRUCache(maxsize=MAX_TRACKED_BOTS)
+alert_state = LRUCache(maxsize=MAX_TRACKED_BOTS)
 _state_lock = threading.Lock()
 
+# Pool persistente para as checagens (criado uma vez, reaproveitado a cada ciclo)
+_check_executor = ThreadPoolExecutor(max_workers=MONITOR_MAX_WORKERS, thread_name_prefix="tok4-check")
+# Sinal de parada do monitor: a espera entre ciclos é interrompível (shutdown limpo)
+_monitor_stop = threading.Event()
+
+# Snapshot imutável do bot: as threads do pool não tocam na sessão do SQLAlchemy
+# `diag_state`/`last_ok` permitem pular a escrita de bots saudáveis que não mudaram
+BotSnapshot = namedtuple("BotSnapshot", "id name token redirect_url failures last_ok diag_state")
+
 # ================================
 # CORS básico (sem dependências)
 # ================================
@@ -114,15 +182,49 @@ def cors_preflight(_):
 # ================================
 # Funções auxiliares
 # ================================
+# (segundo, "[YYYY-mm-dd HH:MM:SS UTC]"): strftime roda no máximo uma vez por segundo
+_log_ts_cache = (0, "")
+
+def _log_timestamp() -> str:
+    global _log_ts_cache
+    sec = int(time.time())
+    cached_sec, cached = _log_ts_cache
+    if sec != cached_sec:
+        cached = time.strftime("[%Y-%m-%d %H:%M:%S UTC]", time.gmtime(sec))
+        _log_ts_cache = (sec, cached)  # troca atômica da tupla: seguro entre threads
+    return cached
+
 def add_log(msg: str):
-    ts = now_utc().strftime("%Y-%m-%d %H:%M:%S %Z")
-    line = f"[{ts}] {msg}"
+    line = f"{_log_timestamp()} {msg}"
     with _state_lock:
-        monitor_logs.append(line)
-        if len(monitor_logs) > MAX_LOGS:
-            monitor_logs.pop(0)
+        monitor_logs.append((next(_log_seq), line))
     logger.info(msg)
 
+def _tail_logs(limit: int) -> list:
+    """Cópia das últimas `limit` linhas de log (chamar com _state_lock)."""
+    limit = max(1, min(limit, MAX_LOGS))
+    return [line for _, line in itertools.islice(monitor_logs, max(0, len(monitor_logs) - limit), None)]
+
+def _logs_since(seq: int) -> list:
+    """Linhas com seq > `seq`, em ordem (chamar com _state_lock). Varre só o trecho novo."""
+    newer = list(itertools.takewhile(lambda entry: entry[0] > seq, reversed(monitor_logs)))
+    return [line for _, line in reversed(newer)]
+
+def _last_log_seq() -> int:
+    return monitor_logs[-1][0] if monitor_logs else 0
+
+def inc_metric(key: str, n: int = 1, **gauges):
+    """Incremento atômico do contador (read-modify-write sob lock) + gauges opcionais."""
+    with _metrics_lock:
+        metrics[key] = metrics.get(key, 0) + n
+        metrics.update(gauges)
+
+def metrics_snapshot() -> dict:
+    with _metrics_lock:
+        snap = dict(metrics)
+    snap["diag_timeouts_total"] = diag_timeouts_total()
+    return snap
+
 def safe_commit():
     try:
         db.session.commit()
@@ -132,25 +234,17 @@ def safe_commit():
         add_log(f"❌ Erro no commit: {e}")
         return False
 
-def send_whatsapp(title: str, details: str):
-    if not twilio_client or not (TWILIO_FROM and ADMIN_WHATSAPP):
-        add_log("⚠️ Twilio não configurado.")
-        return
-    msg = (
+def _format_whatsapp(title: str, details: str) -> str:
+    return (
         "📡 *TOK4 Monitor*\n\n"
         f"🔔 {title}\n\n"
         f"{details}\n\n"
         f"⏰ {time.strftime('%d/%m %H:%M:%S')}"
     )
-    try:
-        twilio_client.messages.create(
-            body=msg,
-            from_=f"whatsapp:{TWILIO_FROM}",
-            to=f"whatsapp:{ADMIN_WHATSAPP}"
-        )
-        add_log("📲 WhatsApp enviado")
-    except Exception as e:
-        add_log(f"❌ Erro ao enviar WhatsApp: {e}")
+
+def notify_whatsapp(title: str, details: str):
+    """Alerta via fila de notificações (não bloqueia; coalescido com os demais)."""
+    enqueue_whatsapp(_format_whatsapp(title, details))
 
 def _rollback_if_failed_tx(e: Exception):
     try:
@@ -159,15 +253,98 @@ def _rollback_if_failed_tx(e: Exception):
     except Exception:
         pass
 
+def persist_cycle_results(rows: list, failed_ids: list = ()) -> bool:
+    """
+    Grava os resultados do ciclo num único executemany (UPDATE por PK) e um commit,
+    em vez de uma transação por bot. As falhas são incrementadas no próprio banco
+    (failures = failures + 1), na mesma transação.
+    """
+    if not rows and not failed_ids:
+        return True
+    try:
+        if rows:
+            db.session.execute(update(Bot), rows)
+        Bot.bulk_increment_failures(failed_ids)
+    except (SQLAlchemyError, DBAPIError) as e:
+        db.session.rollback()
+        add_log(f"❌ Erro ao gravar resultados do ciclo: {e}")
+        return False
+    return safe_commit()
+
+# Só as colunas que o ciclo lê (snapshot + comparação de estado); o resto fica de fora do SELECT
+_CYCLE_COLUMNS = (
+    Bot.id, Bot.name, Bot.token, Bot.redirect_url, Bot.failures, Bot.last_ok,
+    Bot.last_token_ok, Bot.last_url_ok, Bot.last_webhook_ok, Bot.last_reason,
+)
+
+# montado uma vez (import); select() 2.0 reaproveita o SQL compilado do cache a cada ciclo
+_ACTIVE_CYCLE_STMT = (
+    select(Bot)
+    .options(load_only(*_CYCLE_COLUMNS), raiseload("*"))
+    .where(Bot.status == "ativo")
+    .order_by(Bot.id.asc())
+)
+
 def get_bots_from_db():
+    """Bots ativos do ciclo (a reserva é buscada sob demanda no swap, via pick_reserve)."""
     try:
-        ativos = Bot.query.filter_by(status="ativo").order_by(Bot.id.asc()).all()
-        reserva = Bot.query.filter_by(status="reserva").order_by(Bot.id.asc()).all()
-        return ativos, reserva
+        return db.session.scalars(_ACTIVE_CYCLE_STMT).all()
     except (SQLAlchemyError, DBAPIError) as e:
         _rollback_if_failed_tx(e)
         add_log(f"❌ Erro ao consultar banco: {e}")
-        return [], []
+        return []
+
+def _snapshot(bot) -> BotSnapshot:
+    return BotSnapshot(
+        bot.id, bot.name, bot.token, bot.redirect_url, bot.failures or 0, bot.last_ok,
+        (bot.last_token_ok, bot.last_url_ok, bot.last_webhook_ok, bot.last_reason),
+    )
+
+def _unchanged_healthy(snap: BotSnapshot, row: dict, now) -> bool:
+    """OK→OK sem mudança de diagnóstico e com last_ok recente: nada a gravar neste ciclo."""
+    if snap.failures or not snap.last_ok:
+        return False
+    # last_ok volta naive quando a coluna é TIMESTAMP sem fuso: aware - naive daria TypeError
+    if (now - as_utc(snap.last_ok)).total_seconds() >= HEALTHY_REFRESH_SECONDS:
+        return False
+    state = (row["last_token_ok"], row["last_url_ok"], row["last_webhook_ok"], row["last_reason"])
+    return state == snap.diag_state
+
+def pick_reserve(exclude_id: int = None):
+    try:
+        return Bot.pick_reserve(exclude_id=exclude_id)
+    except (SQLAlchemyError, DBAPIError) as e:
+        _rollback_if_failed_tx(e)
+        add_log(f"❌ Erro ao buscar bot da reserva: {e}")
+        return None
+
+def swap_bot(bot):
+    """
+    Rebaixa `bot` para reserva e promove o próximo reserva numa única transação:
+    o reserva é travado (FOR UPDATE SKIP LOCKED) antes das escritas e tudo sai num
+    commit só. Retorna (ok, novo); novo=None quando não há reserva disponível.
+    """
+    novo = pick_reserve(exclude_id=bot.id)
+    bot.mark_reserve()
+    if novo:
+        novo.mark_active()
+    if not safe_commit():
+        return False, None
+    invalidate_health_cache(bot.token)
+    if novo:
+        invalidate_health_cache(novo.token)
+    return True, novo
+
+def get_status_counts() -> dict:
+    try:
+        return Bot.status_counts()
+    except (SQLAlchemyError, DBAPIError) as e:
+        _rollback_if_failed_tx(e)
+        add_log(f"❌ Erro ao contar bots: {e}")
+        return {}
+
+def _bot_not_found():
+    return jsonify({"error": "Bot não encontrado"}), 404
 
 def _get_payload():
     """
@@ -184,6 +361,14 @@ def _get_payload():
         data["redirect_url"] = data.pop("url")
     return data
 
+BOT_STATUSES = ("ativo", "reserva", "inativo")
+NEW_BOT_STATUS = "ativo"  # padrão de cadastro (unitário e em lote)
+
+def _parse_status(value, default: str = NEW_BOT_STATUS):
+    """Status do payload (vazio → `default`); None se não for um dos BOT_STATUSES."""
+    status = value or default
+    return status if status in BOT_STATUSES else None
+
 # ================================
 # Enriquecimento de leads + envio (subscribe)
 # ================================
@@ -246,7 +431,8 @@ def _send_to_typebot(enriched: dict) -> dict:
             "lead": enriched
         }
         # POST genérico; a API exata pode variar conforme seu conector
-        resp = requests.post(TYPEBOT_API, json=out, timeout=HTTP_TIMEOUT)
+        # (Session compartilhada do utils: conexão keep-alive com o Typebot entre leads)
+        resp = requests_session.post(TYPEBOT_API, json=out, timeout=HTTP_TIMEOUT)
         info["status"] = resp.status_code
         if 200 <= resp.status_code < 300:
             info["sent"] = True
@@ -261,13 +447,28 @@ def _send_to_typebot(enriched: dict) -> dict:
 # ================================
 # Verificação confiável (com WebhookInfo inteligente)
 # ================================
-def _run_checks_once(bot):
-    token_ok, token_reason, username = check_token(bot.token or "")
-    url_ok, url_reason = check_link(bot.redirect_url or "")
-    probe_ok, probe_reason = check_probe(bot.token, MONITOR_CHAT_ID)
-    webhook_ok, webhook_reason, webhook_info = check_webhook(bot.token or "")
-
-    decision_ok = bool(token_ok and (probe_ok is True or probe_ok is None))
+def _run_checks_once(bot, use_cache: bool = True, check_url: bool = True, url_checks: dict = None):
+    token_ok, token_reason, username = check_token(bot.token or "", use_cache=use_cache)
+    if check_url and LINK_CHECK_ENABLED:
+        # URL repetida entre bots: reaproveita a checagem única disparada pelo ciclo
+        url_future = (url_checks or {}).get(bot.redirect_url or "")
+        url_ok, url_reason = url_future.result() if url_future else check_link(bot.redirect_url or "")
+    else:
+        url_ok, url_reason = None, "URL não checada"
+    if token_ok is None:
+        # bulkhead cheio (saturação local): sem veredito do token, nada de probe/webhook
+        probe_ok, probe_reason = None, "Pulado (token inconclusivo)"
+        webhook_ok, webhook_reason, webhook_info = None, "Pulado (token inconclusivo)", {}
+    elif token_ok:
+        probe_ok, probe_reason = check_probe(bot.token, MONITOR_CHAT_ID)
+        webhook_ok, webhook_reason, webhook_info = check_webhook(bot.token or "")
+    else:
+        # mesmo token: probe/webhook falhariam com certeza, só gastariam dois timeouts
+        probe_ok, probe_reason = None, "Pulado (token inválido)"
+        webhook_ok, webhook_reason, webhook_info = False, "Pulado (token inválido)", {}
+
+    # None = inconclusivo (token sem veredito): o ciclo pula o bot, sem contar falha
+    decision_ok = None if token_ok is None else bool(token_ok and (probe_ok is True or probe_ok is None))
 
     if decision_ok and not webhook_ok:
         add_log(f"⚠️ {bot.name}: webhook falhou ({webhook_reason}), mas bot responde normalmente.")
@@ -289,24 +490,50 @@ def _run_checks_once(bot):
     }
     return diag, decision_ok
 
-def diagnosticar_bot(bot):
-    diag1, ok1 = _run_checks_once(bot)
+# Falhas definitivas do token (auth/formato): repetir só custa tempo e chamadas
+_PERMANENT_TOKEN_FAILURES = ("HTTP 401", "HTTP 403", "HTTP 404", "formato inválido", "Token vazio")
+
+def _is_transient_failure(diag: dict) -> bool:
+    reason = diag["reasons"].get("token") or ""
+    return not any(marker in reason for marker in _PERMANENT_TOKEN_FAILURES)
+
+def _retry_delay(attempt: int) -> float:
+    """Full jitter: bots falhando juntos não voltam à Bot API em sincronia."""
+    return random.uniform(0.0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * (2 ** attempt)))
+
+def diagnosticar_bot(bot, url_checks: dict = None):
+    """Diag do bot, ou None se inconclusivo (saturação local): o ciclo não grava nem conta falha."""
+    diag1, ok1 = _run_checks_once(bot, url_checks=url_checks)
+    if ok1 is None:
+        add_log(f"⏸️ {bot.name}: checagem inconclusiva ({diag1['reasons']['token']}); fica para o próximo ciclo.")
+        return None
     if ok1:
         return diag1
+    if not _is_transient_failure(diag1):
+        return diag1
 
     delay = DOUBLECHECK_DELAY_SECONDS + random.uniform(0.0, 1.5)
     add_log(f"⏳ {bot.name}: primeira checagem falhou, aguardando {delay:.1f}s...")
     time.sleep(delay)
 
-    diag2, ok2 = _run_checks_once(bot)
+    # Retentativas não repetem a checagem de URL (não decide); reaproveitam a da 1ª passada
+    diag2, ok2 = _run_checks_once(bot, use_cache=False, check_url=False)
+    _keep_url_result(diag2, diag1)
+    if ok2 is None:
+        return None
     if ok2:
         add_log(f"🔁 {bot.name}: recuperação confirmada na segunda checagem.")
         return diag2
 
     last_diag = diag2
-    for _ in range(max(0, RETRY_CHECKS_PER_PASS - 1)):
-        time.sleep(1.0 + random.uniform(0.0, 1.0))
-        d, ok = _run_checks_once(bot)
+    for attempt in range(1, RETRY_CHECKS_PER_PASS):
+        if not _is_transient_failure(last_diag):
+            break
+        time.sleep(_retry_delay(attempt))
+        d, ok = _run_checks_once(bot, use_cache=False, check_url=False)
+        _keep_url_result(d, diag1)
+        if ok is None:
+            return None
         last_diag = d
         if ok:
             add_log(f"🔁 {bot.name}: recuperação confirmada em tentativa extra.")
@@ -315,162 +542,313 @@ def diagnosticar_bot(bot):
     last_diag["decision_ok"] = False
     return last_diag
 
+def _keep_url_result(diag: dict, first: dict):
+    diag["url_ok"] = first["url_ok"]
+    diag["reasons"]["url"] = first["reasons"]["url"]
+
+def _run_checks_with_budget(snapshots, budget: float) -> dict:
+    """
+    Dispara as checagens no pool e coleta o que terminar dentro do orçamento.
+    Um bot lento/inalcançável não estica o ciclo: o que sobrar é cancelado
+    (ou, se já estiver rodando, ignorado) e volta a ser checado no próximo ciclo.
+    """
+    # Uma checagem por redirect_url distinta, submetida antes dos bots (FIFO do pool):
+    # bots que compartilham a URL esperam o mesmo Future em vez de repetir o request
+    url_checks = {}
+    if LINK_CHECK_ENABLED:
+        for url in {snap.redirect_url or "" for snap in snapshots}:
+            url_checks[url] = _check_executor.submit(check_link, url)
+    futures = {_check_executor.submit(diagnosticar_bot, snap, url_checks): snap for snap in snapshots}
+    diags = {}
+    try:
+        for fut in as_completed(futures, timeout=max(1.0, budget)):
+            snap = futures[fut]
+            try:
+                diags[snap.id] = fut.result()
+            except Exception as e:
+                add_log(f"❌ {snap.name}: erro inesperado na checagem: {e}")
+    except FuturesTimeoutError:
+        pending = [f for f in futures if not f.done()]
+        for f in pending:
+            f.cancel()
+        for f in url_checks.values():
+            f.cancel()
+        inc_metric("check_timeouts_total", len(pending))
+        add_log(f"⏱️ {len(pending)} checagem(ns) estouraram o orçamento do ciclo ({budget:.0f}s); ficam para o próximo.")
+    return diags
+
+def _idle_until_next_cycle(seconds: float):
+    """Espera o próximo ciclo (interrompível), reaquecendo a conexão do Telegram no meio."""
+    deadline = time.monotonic() + seconds
+    while not _monitor_stop.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if TELEGRAM_KEEPALIVE_SECONDS <= 0 or remaining <= TELEGRAM_KEEPALIVE_SECONDS:
+            _monitor_stop.wait(remaining)
+            return
+        if _monitor_stop.wait(TELEGRAM_KEEPALIVE_SECONDS):
+            return
+        warm_up_telegram()
+
 # ================================
 # Loop de monitoramento
 # ================================
-@contextmanager
-def _flask_app_context():
-    with app.app_context():
-        yield
+def _run_monitor_cycle(interval: int, started_at):
+    """Um ciclo do monitor: checagens em paralelo, gravação em lote e trocas por reserva."""
+    in_grace = (now_utc() - started_at).total_seconds() < STARTUP_GRACE_SECONDS
+    ativos = get_bots_from_db()
+    if not ativos:
+        add_log("💤 Nenhum bot ativo para checar.")
+        return
+
+    # fan-out: checagens de rede em paralelo; mutações no banco ficam nesta thread
+    snapshots = [_snapshot(b) for b in ativos]
+    for snap in snapshots:
+        add_log(f"🔎 Checando {snap.name} → {snap.redirect_url}")
+    diags = _run_checks_with_budget(snapshots, interval * CHECK_BUDGET_RATIO)
+
+    now = now_utc()
+    rows = []
+    failed_ids = []
+    to_swap = []
+    for snap in snapshots:
+        diag = diags.get(snap.id)
+        if diag is None:
+            continue
+        inc_metric("checks_total", last_check_ts=int(time.time()))
+
+        with _state_lock:
+            diag_cache[snap.id] = {"when": int(time.time()), "diag": diag}
+
+        row = {
+            "id": snap.id,
+            "last_token_ok": diag.get("token_ok"),
+            "last_url_ok": diag.get("url_ok"),
+            "last_webhook_ok": diag.get("webhook_ok"),
+            "health_mask": health_mask(diag.get("token_ok"), diag.get("url_ok"), diag.get("webhook_ok")),
+            "last_reason": json.dumps(diag.get("reasons", {}), ensure_ascii=False),
+        }
+
+        add_log(
+            f"📋 Diagnóstico {snap.name}: "
+            f"token_ok={diag['token_ok']}, url_ok={diag['url_ok']}, "
+            f"probe_ok={diag['probe_ok']}, webhook_ok={diag['webhook_ok']} "
+            f"| R: {diag['reasons']} | webhook_info={diag['webhook_info']}"
+        )
+
+        if diag["decision_ok"]:
+            if not _unchanged_healthy(snap, row, now):
+                row.update(failures=0, last_ok=now)
+                rows.append(row)
+            add_log(f"✅ {snap.name}: OK")
+            with _state_lock:
+                alert_state[snap.id] = {"last_fail_count": 0, "last_alert_ts": None}
+            continue
+
+        fail_cnt = snap.failures + 1  # espelho local do incremento feito no banco
+        rows.append(row)
+        failed_ids.append(snap.id)
+        inc_metric("failures_total")
+        add_log(f"⚠️ {snap.name}: queda confirmada ({fail_cnt}/{FAIL_THRESHOLD})")
+
+        should_alert = False
+        with _state_lock:
+            st = alert_state.get(snap.id) or {}
+            last_fail_seen = st.get("last_fail_count", 0)
+            if fail_cnt != last_fail_seen or fail_cnt == FAIL_THRESHOLD:
+                should_alert = True
+            alert_state[snap.id] = {"last_fail_count": fail_cnt, "last_alert_ts": int(time.time())}
+
+        if should_alert:
+            notify_whatsapp(
+                "⚠️ Bot com problema",
+                f"Nome: {snap.name}\nURL: {snap.redirect_url}\nFalhas: {fail_cnt}/{FAIL_THRESHOLD}\n"
+                f"🔑 Token: {diag['reasons'].get('token')}\n🌍 URL: {diag['reasons'].get('url')}\n"
+                f"📡 Probe: {diag['reasons'].get('probe')}\n🔗 Webhook: {diag['reasons'].get('webhook')}"
+            )
+
+        if not in_grace and fail_cnt >= FAIL_THRESHOLD:
+            to_swap.append(snap.id)
+
+    # um único UPDATE em lote (executemany por PK) + um commit por ciclo
+    persist_cycle_results(rows, failed_ids)
+
+    # bots a trocar numa consulta só (em vez de um get por bot)
+    swap_bots = Bot.load_all_indexed("id", to_swap) if to_swap else {}
+    for bot_id in to_swap:
+        bot = swap_bots.get(bot_id)
+        if not bot:
+            continue
+        ok, novo = swap_bot(bot)
+        if not ok:
+            continue
+        add_log(f"🔁 {bot.name} movido para 'reserva'.")
+        if novo:
+            inc_metric("switches_total")
+            notify_whatsapp(
+                "🔄 Substituição Automática",
+                f"❌ {bot.name} caiu\n➡️ ✅ {novo.name} ativo\nNovo URL: {novo.redirect_url}"
+            )
+            add_log(f"✅ Troca concluída: {bot.name} ➜ {novo.name}")
+        else:
+            notify_whatsapp("❌ Falha Crítica", "Não há mais bots na reserva!")
 
 def monitor_loop(interval: int = MONITOR_INTERVAL):
     started_at = now_utc()
-    with _flask_app_context():
+    warm_up_telegram()
+    with app.app_context():
         add_log("🔄 Iniciando varredura de bots...")
-        ativos, reserva = get_bots_from_db()
-        add_log(f"✅ Monitor ativo | Ativos: {len(ativos)} | Reserva: {len(reserva)}")
-        send_whatsapp("🚀 Monitor Iniciado", f"Ativos: {len(ativos)} | Reservas: {len(reserva)}")
-
-        while True:
-            cycle_started = now_utc()
-            in_grace = (cycle_started - started_at).total_seconds() < STARTUP_GRACE_SECONDS
-            ativos, reserva = get_bots_from_db()
-
-            for bot in ativos:
-                add_log(f"🔎 Checando {bot.name} → {bot.redirect_url}")
-                metrics["checks_total"] += 1
-                metrics["last_check_ts"] = int(time.time())
-
-                diag = diagnosticar_bot(bot)
-                with _state_lock:
-                    diag_cache[bot.id] = {"when": int(time.time()), "diag": diag}
-
-                try:
-                    bot.last_token_ok = diag.get("token_ok")
-                    bot.last_url_ok = diag.get("url_ok")
-                    bot.last_webhook_ok = diag.get("webhook_ok")
-                    bot.last_reason = json.dumps(diag.get("reasons", {}), ensure_ascii=False)
-                except Exception:
-                    pass
-
-                add_log(
-                    f"📋 Diagnóstico {bot.name}: "
-                    f"token_ok={diag['token_ok']}, url_ok={diag['url_ok']}, "
-                    f"probe_ok={diag['probe_ok']}, webhook_ok={diag['webhook_ok']} "
-                    f"| R: {diag['reasons']} | webhook_info={diag['webhook_info']}"
-                )
-
-                if diag["decision_ok"]:
-                    bot.reset_failures()
-                    bot.last_ok = now_utc()
-                    safe_commit()
-                    add_log(f"✅ {bot.name}: OK")
-                    with _state_lock:
-                        alert_state[bot.id] = {"last_fail_count": 0, "last_alert_ts": None}
-                    continue
-
-                bot.increment_failure()
-                metrics["failures_total"] += 1
-                fail_cnt = bot.failures or 0
-                add_log(f"⚠️ {bot.name}: queda confirmada ({fail_cnt}/{FAIL_THRESHOLD})")
-
-                should_alert = False
-                with _state_lock:
-                    st = alert_state.get(bot.id) or {}
-                    last_fail_seen = st.get("last_fail_count", 0)
-                    if fail_cnt != last_fail_seen or fail_cnt == FAIL_THRESHOLD:
-                        should_alert = True
-                    alert_state[bot.id] = {"last_fail_count": fail_cnt, "last_alert_ts": int(time.time())}
-
-                if should_alert:
-                    send_whatsapp(
-                        "⚠️ Bot com problema",
-                        f"Nome: {bot.name}\nURL: {bot.redirect_url}\nFalhas: {fail_cnt}/{FAIL_THRESHOLD}\n"
-                        f"🔑 Token: {diag['reasons'].get('token')}\n🌍 URL: {diag['reasons'].get('url')}\n"
-                        f"📡 Probe: {diag['reasons'].get('probe')}\n🔗 Webhook: {diag['reasons'].get('webhook')}"
-                    )
-
-                if in_grace:
-                    safe_commit()
-                    continue
-
-                if fail_cnt >= FAIL_THRESHOLD:
-                    bot.mark_reserve()
-                    safe_commit()
-                    add_log(f"🔁 {bot.name} movido para 'reserva'.")
-                    _, reserva_atual = get_bots_from_db()
-                    if reserva_atual:
-                        novo = reserva_atual[0]
-                        novo.mark_active()
-                        if safe_commit():
-                            metrics["switches_total"] += 1
-                            send_whatsapp(
-                                "🔄 Substituição Automática",
-                                f"❌ {bot.name} caiu\n➡️ ✅ {novo.name} ativo\nNovo URL: {novo.redirect_url}"
-                            )
-                            add_log(f"✅ Troca concluída: {bot.name} ➜ {novo.name}")
-                    else:
-                        send_whatsapp("❌ Falha Crítica", "Não há mais bots na reserva!")
-
-            elapsed = (now_utc() - cycle_started).total_seconds()
-            time.sleep(max(1.0, interval - elapsed))
+        counts = get_status_counts()
+        n_ativos, n_reserva = counts.get("ativo", 0), counts.get("reserva", 0)
+        add_log(f"✅ Monitor ativo | Ativos: {n_ativos} | Reserva: {n_reserva}")
+        notify_whatsapp("🚀 Monitor Iniciado", f"Ativos: {n_ativos} | Reservas: {n_reserva}")
+
+        while not _monitor_stop.is_set():
+            cycle_started = time.monotonic()  # imune a ajustes do relógio (NTP)
+            try:
+                _run_monitor_cycle(interval, started_at)
+            except Exception as e:
+                # uma linha ruim/erro inesperado não pode derrubar a thread do monitor de vez
+                add_log(f"❌ Erro no ciclo do monitor (segue no próximo): {e}")
+            finally:
+                # fecha a transação em todo caminho (ciclo sem escrita não faz commit):
+                # devolve a conexão ao pool (nada de "idle in transaction" entre ciclos) e
+                # zera o identity map, então o próximo SELECT enxerga edições do dashboard
+                db.session.remove()
+
+            elapsed = time.monotonic() - cycle_started
+            if elapsed > interval:
+                add_log(f"⏱️ Ciclo levou {elapsed:.1f}s (> intervalo de {interval}s); próximo ciclo atrasado.")
+            _idle_until_next_cycle(max(1.0, interval - elapsed))
+        add_log("🛑 Monitor encerrado.")
 
 # ================================
 # Bootstrap (garante schema atualizado)
 # ================================
+# Colunas/índices que o monitor e o dashboard esperam encontrar em `bots`
+_BOOTSTRAP_COLUMNS = (
+    "redirect_url", "last_ok", "failures", "last_reason",
+    "last_token_ok", "last_url_ok", "last_webhook_ok", "health_mask",
+    "last_token_http", "last_url_http",
+    "last_webhook_url", "last_webhook_error", "last_webhook_error_at", "pending_update_count",
+    "updated_at", "created_at",
+)
+_BOOTSTRAP_INDEXES = (
+    "idx_status_failures", "idx_name_status", "idx_failures_updated",
+    "idx_bots_reserva_updated", "idx_bots_active", "idx_bots_inactive", "ix_bots_health_mask",
+)
+# colunas que precisam de DEFAULT no banco (o ORM não manda mais o valor no INSERT)
+_BOOTSTRAP_DEFAULTS = ("created_at", "updated_at")
+_BOOTSTRAP_LOCK_KEY = 4242  # pg advisory lock: só um worker aplica o patch por vez
+
+# Statements montados uma única vez (import), reaproveitados a cada boot
+PATCH_SQL = tuple(text(sql) for sql in (
+    # garante todas as colunas usadas no monitor e dashboard (TIMESTAMPTZ para coerência com timezone-aware)
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS redirect_url TEXT",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_ok TIMESTAMPTZ NULL",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS failures INTEGER DEFAULT 0",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_reason TEXT",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_token_ok BOOLEAN",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_url_ok BOOLEAN",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_ok BOOLEAN",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS health_mask SMALLINT",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_token_http INTEGER",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_url_http INTEGER",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_url TEXT",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_error TEXT",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_error_at TIMESTAMPTZ",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS pending_update_count INTEGER",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ",
+    "ALTER TABLE bots ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ",
+    # timestamps pelo relógio do banco (espelha a migration d4f7a3b8e215)
+    "ALTER TABLE bots ALTER COLUMN created_at SET DEFAULT now()",
+    "ALTER TABLE bots ALTER COLUMN updated_at SET DEFAULT now()",
+
+    # índice parcial na ordem do pick_reserve (updated_at, id), espelha a migration f3a9c6d1b024: o próximo reserva sai
+    # direto do índice, sem sort; substitui o antigo idx_bots_reserva_id
+    "CREATE INDEX IF NOT EXISTS idx_bots_reserva_updated ON bots (updated_at, id) WHERE status = 'reserva'",
+    "DROP INDEX IF EXISTS idx_bots_reserva_id",
+
+    # parciais por status (espelham a migration b7c41e2d9f10): o ciclo do monitor
+    # (status='ativo' ORDER BY id) não varre as linhas de reserva
+    "CREATE INDEX IF NOT EXISTS idx_bots_active ON bots (id) WHERE status = 'ativo'",
+    "CREATE INDEX IF NOT EXISTS idx_bots_inactive ON bots (failures) WHERE status = 'inativo'",
+    "CREATE INDEX IF NOT EXISTS ix_bots_health_mask ON bots (health_mask)",
+
+    # índices úteis e idempotentes (PostgreSQL)
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'i' AND c.relname = 'idx_status_failures'
+        ) THEN
+            CREATE INDEX idx_status_failures ON bots (status, failures);
+        END IF;
+
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'i' AND c.relname = 'idx_name_status'
+        ) THEN
+            CREATE INDEX idx_name_status ON bots (name, status);
+        END IF;
+
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'i' AND c.relname = 'idx_failures_updated'
+        ) THEN
+            CREATE INDEX idx_failures_updated ON bots (failures DESC, updated_at ASC);
+        END IF;
+    END$$;
+    """,
+))
+
+def _schema_is_current(conn) -> bool:
+    """Sonda barata (catálogo) para evitar DDL com ACCESS EXCLUSIVE a cada boot."""
+    defaults = dict(conn.execute(text(
+        "SELECT column_name, column_default FROM information_schema.columns WHERE table_name = 'bots'"
+    )).all())
+    indexes = set(conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'bots'"
+    )).scalars())
+    return (
+        set(_BOOTSTRAP_COLUMNS) <= defaults.keys()
+        and all(defaults.get(c) for c in _BOOTSTRAP_DEFAULTS)
+        and set(_BOOTSTRAP_INDEXES) <= indexes
+    )
+
 def _apply_bootstrap_patches():
+    if not SCHEMA_BOOTSTRAP:
+        add_log("⏭️ SCHEMA_BOOTSTRAP desligado: schema fica a cargo das migrations.")
+        return
     with app.app_context():
         try:
             with db.engine.begin() as conn:
-                # garante todas as colunas usadas no monitor e dashboard (TIMESTAMPTZ para coerência com timezone-aware)
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS redirect_url TEXT"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_ok TIMESTAMPTZ NULL"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS failures INTEGER DEFAULT 0"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_reason TEXT"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_token_ok BOOLEAN"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_url_ok BOOLEAN"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_ok BOOLEAN"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_token_http INTEGER"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_url_http INTEGER"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_url TEXT"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_error TEXT"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS last_webhook_error_at TIMESTAMPTZ"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS pending_update_count INTEGER"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ"))
-                conn.execute(text("ALTER TABLE bots ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ"))
-
-                # índices úteis e idempotentes (PostgreSQL)
-                conn.execute(text("""
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_class c
-                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                            WHERE c.relkind = 'i' AND c.relname = 'idx_status_failures'
-                        ) THEN
-                            CREATE INDEX idx_status_failures ON bots (status, failures);
-                        END IF;
-
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_class c
-                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                            WHERE c.relkind = 'i' AND c.relname = 'idx_name_status'
-                        ) THEN
-                            CREATE INDEX idx_name_status ON bots (name, status);
-                        END IF;
-
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_class c
-                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                            WHERE c.relkind = 'i' AND c.relname = 'idx_failures_updated'
-                        ) THEN
-                            CREATE INDEX idx_failures_updated ON bots (failures, updated_at);
-                        END IF;
-                    END$$;
-                """))
+                if _schema_is_current(conn):
+                    add_log("✅ Schema já atualizado (patch dispensado)")
+                    return
+                if conn.dialect.name == "postgresql":
+                    # ALTER/CREATE INDEX esperam lock ACCESS EXCLUSIVE em tabela movimentada:
+                    # o statement_timeout das conexões do app derrubaria o patch inteiro
+                    conn.execute(text("SET LOCAL statement_timeout = 0"))
+                locked = conn.execute(
+                    text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _BOOTSTRAP_LOCK_KEY}
+                ).scalar()
+                if not locked:
+                    add_log("🔁 Patch do schema em andamento em outro worker; pulando.")
+                    return
+                for stmt in PATCH_SQL:
+                    conn.execute(stmt)
             add_log("✅ Patch no schema aplicado")
         except Exception as e:
-            add_log(f"⚠️ Patch falhou (ignorado se não-Postgres): {e}")
+            if db.engine.dialect.name == "postgresql":
+                add_log(f"❌ Patch do schema falhou (rollback, nada aplicado): {e}")
+            else:
+                add_log(f"⚠️ Patch falhou (ignorado se não-Postgres): {e}")
 
 # ================================
 # Controle do Monitor
@@ -510,6 +888,13 @@ def _start_monitor_background():
     _monitor_thread.start()
     add_log("🧵 Thread de monitoramento iniciada.")
 
+@atexit.register
+def _stop_monitor():
+    """No SIGTERM/saída do worker: acorda o monitor e descarta checagens pendentes."""
+    _monitor_stop.set()
+    _check_executor.shutdown(wait=False, cancel_futures=True)
+    flush_whatsapp_queue()  # não perde alertas ainda na fila
+
 # ================================
 # Rotas Dashboard/API (CRUD completo + utilitários)
 # ================================
@@ -521,11 +906,35 @@ def index():
 @app.route("/health")
 @app.route("/healthz")
 def health():
-    return jsonify({"ok": True, "ts": int(time.time())})
+    # Uma única consulta agregada (GROUP BY status) em vez de um count() por status
+    counts = get_status_counts()
+    return jsonify({
+        "ok": True,
+        "ts": int(time.time()),
+        "ativos": counts.get("ativo", 0),
+        "reserva": counts.get("reserva", 0),
+        "inativos": counts.get("inativo", 0),
+    })
 
 @app.route("/api/metrics", methods=["GET"])
 def api_metrics():
-    return jsonify(metrics)
+    return jsonify(metrics_snapshot())
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Exposição no formato texto do Prometheus (sem passar por JSON)."""
+    snap = metrics_snapshot()
+    lines = []
+    for key, value in snap.items():
+        if value is None:
+            continue
+        kind = "counter" if key.endswith("_total") else "gauge"
+        lines.append(f"# TYPE tok4_{key} {kind}")
+        lines.append(f"tok4_{key} {value}")
+    resp = make_response("\n".join(lines) + "\n", 200)
+    resp.mimetype = "text/plain"
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
 
 @app.route("/api/logs", methods=["GET"])
 def api_logs():
@@ -535,9 +944,13 @@ def api_logs():
             limit = int(limit)
         except Exception:
             limit = 200
+        limit = max(1, min(limit, MAX_LOGS))  # mesmo clamp do _tail_logs, vale também para ?since=
+        since = request.args.get("since", type=int)
         with _state_lock:
-            logs = monitor_logs[-max(1, min(limit, MAX_LOGS)):]
-        return jsonify({"logs": logs, "count": len(logs)})
+            logs = _tail_logs(limit) if since is None else _logs_since(since)[-limit:]
+            last_seq = _last_log_seq()
+        # o cliente repassa last_seq como ?since= no próximo poll e recebe só as linhas novas
+        return jsonify({"logs": logs, "count": len(logs), "last_seq": last_seq})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -553,18 +966,18 @@ def api_diag(bot_id):
 @app.route("/api/bots", methods=["GET"])
 def api_bots():
     try:
-        bots = Bot.query.order_by(Bot.id).all()
-        payload = []
-        for b in bots:
-            d = b.to_dict(with_meta=True)
-            cached = diag_cache.get(b.id) or {}
-            d["_diag"] = cached.get("diag")
-            d["_diag_ts"] = cached.get("when")
-            payload.append(d)
+        # com orjson ativo os datetime vão crus: serializados em C, mesmo texto do isoformat()
+        payload = Bot.serialize_many(iso_datetimes=orjson is None)
+        with _state_lock:
+            for d in payload:
+                cached = diag_cache.get(d["id"]) or {}
+                d["_diag"] = cached.get("diag")
+                d["_diag_ts"] = cached.get("when")
         # Inclui logs e last_action para compatibilidade com dashboards
         with _state_lock:
-            logs_copy = list(monitor_logs)
-        return jsonify({"bots": payload, "logs": logs_copy, "metrics": metrics, "last_action": metrics.get("last_check_ts")})
+            logs_copy = _tail_logs(200)
+        snap = metrics_snapshot()
+        return jsonify({"bots": payload, "logs": logs_copy, "metrics": snap, "last_action": snap.get("last_check_ts")})
     except Exception as e:
         _rollback_if_failed_tx(e)
         return jsonify({"error": str(e)}), 500
@@ -576,10 +989,14 @@ def create_bot():
         name = data.get("name")
         token = data.get("token")
         redirect_url = data.get("redirect_url")
-        status = data.get("status", "ativo") or "ativo"
+        status = _parse_status(data.get("status"))
 
         if not name or not token or not redirect_url:
             return jsonify({"error": "name, token e redirect_url são obrigatórios"}), 400
+        if status is None:
+            return jsonify({"error": f"status inválido (use {', '.join(BOT_STATUSES)})"}), 400
+        if not is_token_well_formed(token):
+            return jsonify({"error": "token com formato inválido"}), 400
 
         new_bot = Bot(name=name, token=token, redirect_url=redirect_url, status=status)
         db.session.add(new_bot)
@@ -587,33 +1004,84 @@ def create_bot():
             return jsonify({"error": "Falha ao salvar. Verifique logs."}), 500
 
         add_log(f"➕ Bot {new_bot.name} criado.")
-        send_whatsapp("➕ Novo Bot", f"Nome: {new_bot.name}\nURL: {new_bot.redirect_url}")
+        notify_whatsapp("➕ Novo Bot", f"Nome: {new_bot.name}\nURL: {new_bot.redirect_url}")
         return jsonify(new_bot.to_dict()), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/bots/worst", methods=["GET"])
+def api_bots_worst():
+    try:
+        limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+        return jsonify({"bots": [b.to_dict(include_diag=False) for b in Bot.worst_offenders(limit)]})
+    except Exception as e:
+        _rollback_if_failed_tx(e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/bots/bulk", methods=["POST"])
+def create_bots_bulk():
+    """Cadastro em lote: {"bots": [{name, token, redirect_url, status?}, ...]} num INSERT só."""
+    try:
+        data = request.get_json(silent=True) or {}
+        items = []
+        for i, raw in enumerate(data.get("bots") or []):
+            item = {k: v.strip() if isinstance(v, str) else v for k, v in (raw or {}).items()}
+            if "url" in item and "redirect_url" not in item:
+                item["redirect_url"] = item.pop("url")
+            if not item.get("name") or not item.get("token") or not item.get("redirect_url"):
+                return jsonify({"error": f"bots[{i}]: name, token e redirect_url são obrigatórios"}), 400
+            if not is_token_well_formed(item["token"]):
+                return jsonify({"error": f"bots[{i}]: token com formato inválido"}), 400
+            status = _parse_status(item.get("status"))
+            if status is None:
+                return jsonify({"error": f"bots[{i}]: status inválido (use {', '.join(BOT_STATUSES)})"}), 400
+            items.append({
+                "name": item["name"],
+                "token": item["token"],
+                "redirect_url": item["redirect_url"],
+                "status": status,
+            })
+        if not items:
+            return jsonify({"error": "Informe a lista 'bots'"}), 400
+
+        ids = Bot.bulk_create(items)
+        if not safe_commit():
+            return jsonify({"error": "Falha ao salvar. Verifique logs."}), 500
+
+        add_log(f"➕ {len(ids)} bots criados em lote.")
+        notify_whatsapp("➕ Novos Bots", f"{len(ids)} bots cadastrados em lote.")
+        return jsonify({"ok": True, "ids": ids}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/bots/<int:bot_id>", methods=["PUT"])
 def update_bot(bot_id):
     try:
-        bot = Bot.query.get(bot_id)
+        bot = Bot.get_detail(bot_id)
         if not bot:
-            return jsonify({"error": "Bot não encontrado"}), 404
+            return _bot_not_found()
 
         data = _get_payload()
         if "redirect_url" in data and not data.get("redirect_url"):
             return jsonify({"error": "redirect_url não pode ser vazio"}), 400
+        if "token" in data and not is_token_well_formed(data.get("token")):
+            return jsonify({"error": "token com formato inválido"}), 400
+        status = _parse_status(data.get("status"), default=bot.status) if "status" in data else bot.status
+        if "status" in data and status is None:
+            return jsonify({"error": f"status inválido (use {', '.join(BOT_STATUSES)})"}), 400
 
         bot.name = data.get("name", bot.name)
         bot.token = data.get("token", bot.token)
         bot.redirect_url = data.get("redirect_url", bot.redirect_url)
-        bot.status = data.get("status", bot.status)
+        bot.status = status
 
         if not safe_commit():
             return jsonify({"error": "Falha ao atualizar. Verifique logs."}), 500
 
         add_log(f"✏️ Bot {bot.name} atualizado.")
-        send_whatsapp("✏️ Bot Atualizado", f"Nome: {bot.name}\nURL: {bot.redirect_url}")
+        notify_whatsapp("✏️ Bot Atualizado", f"Nome: {bot.name}\nURL: {bot.redirect_url}")
         return jsonify(bot.to_dict())
     except Exception as e:
         db.session.rollback()
@@ -622,15 +1090,21 @@ def update_bot(bot_id):
 @app.route("/api/bots/<int:bot_id>", methods=["DELETE"])
 def delete_bot(bot_id):
     try:
-        bot = Bot.query.get(bot_id)
+        bot = db.session.get(Bot, bot_id)
         if not bot:
-            return jsonify({"error": "Bot não encontrado"}), 404
+            return _bot_not_found()
         db.session.delete(bot)
         if not safe_commit():
             return jsonify({"error": "Falha ao excluir. Verifique logs."}), 500
 
+        # Estado por bot em memória sai junto com o registro (não espera a LRU expulsar)
+        with _state_lock:
+            diag_cache.pop(bot_id, None)
+            alert_state.pop(bot_id, None)
+        invalidate_health_cache(bot.token)
+
         add_log(f"🗑️ Bot {bot.name} excluído.")
-        send_whatsapp("🗑️ Bot Excluído", f"Nome: {bot.name}")
+        notify_whatsapp("🗑️ Bot Excluído", f"Nome: {bot.name}")
         return jsonify({"ok": True})
     except Exception as e:
         db.session.rollback()
@@ -643,32 +1117,25 @@ def force_swap(bot_id):
     Mantém a mesma lógica de substituição usada no monitor.
     """
     try:
-        atual = Bot.query.get(bot_id)
+        atual = Bot.get_detail(bot_id)
         if not atual:
-            return jsonify({"error": "Bot não encontrado"}), 404
-
-        # Move o bot atual para reserva
-        atual.mark_reserve()
-        safe_commit()
-
-        # Escolhe um bot da reserva (mais antigo/primeiro)
-        _, reserva = get_bots_from_db()
-        if not reserva:
-            send_whatsapp("❌ Forçar Troca", "Não há bots na reserva!")
+            return _bot_not_found()
+
+        # Rebaixa o atual e promove o próximo reserva na mesma transação
+        ok, novo = swap_bot(atual)
+        if not ok:
+            return jsonify({"error": "Falha ao efetivar troca"}), 500
+        if not novo:
+            notify_whatsapp("❌ Forçar Troca", "Não há bots na reserva!")
             return jsonify({"error": "Não há bots na reserva"}), 409
 
-        novo = reserva[0]
-        novo.mark_active()
-        if safe_commit():
-            metrics["switches_total"] += 1
-            send_whatsapp(
-                "🔄 Substituição Forçada",
-                f"❌ {atual.name} ➜ reserva\n➡️ ✅ {novo.name} ativo\nNovo URL: {novo.redirect_url}"
-            )
-            add_log(f"✅ Troca forçada concluída: {atual.name} ➜ {novo.name}")
-            return jsonify({"ok": True, "from": atual.to_dict(), "to": novo.to_dict()})
-
-        return jsonify({"error": "Falha ao efetivar troca"}), 500
+        inc_metric("switches_total")
+        notify_whatsapp(
+            "🔄 Substituição Forçada",
+            f"❌ {atual.name} ➜ reserva\n➡️ ✅ {novo.name} ativo\nNovo URL: {novo.redirect_url}"
+        )
+        add_log(f"✅ Troca forçada concluída: {atual.name} ➜ {novo.name}")
+        return jsonify({"ok": True, "from": atual.to_dict(), "to": novo.to_dict()})
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -676,9 +1143,9 @@ def force_swap(bot_id):
 @app.route("/api/webhookinfo/<int:bot_id>", methods=["GET"])
 def api_webhookinfo(bot_id):
     try:
-        bot = Bot.query.get(bot_id)
+        bot = db.session.get(Bot, bot_id)
         if not bot:
-            return jsonify({"error": "Bot não encontrado"}), 404
+            return _bot_not_found()
         ok, reason, details = check_webhook(bot.token or "")
         return jsonify({"ok": ok, "reason": reason, "details": details})
     except Exception as e:
@@ -0,0 +1,43 @@
+"""partial indexes for active/inactive bot lookups
+
+Revision ID: b7c41e2d9f10
+Revises: a05632b6facb
+Create Date: 2025-10-02 14:20:00.000000
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c41e2d9f10'
+down_revision = 'a05632b6facb'
+branch_labels = None
+depends_on = None
+
+# (nome, colunas, predicado): índices parciais só com as linhas de cada status,
+# em vez de varrer a maioria "reserva" no índice composto (status, failures)
+PARTIAL_INDEXES = (
+    ("idx_bots_active", ["id"], "status = 'ativo'"),
+    ("idx_bots_inactive", ["failures"], "status = 'inativo'"),
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # CREATE INDEX CONCURRENTLY não roda dentro de transação: sem lock de escrita na tabela
+    with op.get_context().autocommit_block():
+        for name, columns, where in PARTIAL_INDEXES:
+            op.create_index(
+                name, "bots", columns,
+                postgresql_where=where,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        for name, _, _ in PARTIAL_INDEXES:
+            op.drop_index(name, table_name="bots", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,34 @@
+"""add health_mask to bots
+
+Revision ID: c2e8a91f4d37
+Revises: b7c41e2d9f10
+Create Date: 2025-10-02 16:05:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e8a91f4d37'
+down_revision = 'b7c41e2d9f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('bots', sa.Column('health_mask', sa.SmallInteger(), nullable=True))
+
+    # preenche a partir dos diagnósticos já gravados: token<<2 | url<<1 | webhook (NULL = ok)
+    op.execute(
+        "UPDATE bots SET health_mask = "
+        "(CASE WHEN last_token_ok THEN 4 ELSE 0 END) + "
+        "(CASE WHEN last_url_ok THEN 2 ELSE 0 END) + "
+        "(CASE WHEN last_webhook_ok IS NOT FALSE THEN 1 ELSE 0 END)"
+    )
+
+    op.create_index('ix_bots_health_mask', 'bots', ['health_mask'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_bots_health_mask', table_name='bots')
+    op.drop_column('bots', 'health_mask')
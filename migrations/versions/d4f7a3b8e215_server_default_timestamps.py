@@ -0,0 +1,36 @@
+"""server-side defaults for bots timestamps
+
+Revision ID: d4f7a3b8e215
+Revises: c2e8a91f4d37
+Create Date: 2025-10-03 10:30:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f7a3b8e215'
+down_revision = 'c2e8a91f4d37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # created_at/updated_at passam a vir do now() do banco: o INSERT não envia mais o valor
+    with op.batch_alter_table('bots', schema=None) as batch_op:
+        batch_op.alter_column(
+            'created_at', existing_type=sa.DateTime(timezone=True), server_default=sa.func.now()
+        )
+        batch_op.alter_column(
+            'updated_at', existing_type=sa.DateTime(timezone=True), server_default=sa.func.now()
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('bots', schema=None) as batch_op:
+        batch_op.alter_column(
+            'created_at', existing_type=sa.DateTime(timezone=True), server_default=None
+        )
+        batch_op.alter_column(
+            'updated_at', existing_type=sa.DateTime(timezone=True), server_default=None
+        )
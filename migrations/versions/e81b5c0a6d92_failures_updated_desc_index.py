@@ -0,0 +1,37 @@
+"""idx_failures_updated with failures DESC
+
+Revision ID: e81b5c0a6d92
+Revises: d4f7a3b8e215
+Create Date: 2025-10-03 11:15:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b5c0a6d92'
+down_revision = 'd4f7a3b8e215'
+branch_labels = None
+depends_on = None
+
+
+def _recreate(*columns):
+    # troca o índice sem lock de escrita: CONCURRENTLY fora de transação
+    with op.get_context().autocommit_block():
+        op.drop_index('idx_failures_updated', table_name='bots',
+                      postgresql_concurrently=True, if_exists=True)
+        op.create_index('idx_failures_updated', 'bots', list(columns),
+                        postgresql_concurrently=True)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # mesma direção do ORDER BY de Bot.worst_offenders (failures DESC, updated_at ASC)
+    _recreate(sa.text('failures DESC'), sa.text('updated_at ASC'))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    _recreate('failures', 'updated_at')
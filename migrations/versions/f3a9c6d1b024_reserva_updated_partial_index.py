@@ -0,0 +1,39 @@
+"""partial index for the reserve pick (updated_at, id)
+
+Revision ID: f3a9c6d1b024
+Revises: e81b5c0a6d92
+Create Date: 2025-10-03 16:40:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c6d1b024'
+down_revision = 'e81b5c0a6d92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # ordem do Bot.pick_reserve (FOR UPDATE SKIP LOCKED ORDER BY updated_at, id):
+    # o próximo reserva sai direto do índice; substitui o antigo idx_bots_reserva_id
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_bots_reserva_updated', 'bots', ['updated_at', 'id'],
+            postgresql_where=sa.text("status = 'reserva'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index('idx_bots_reserva_id', table_name='bots',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('idx_bots_reserva_updated', table_name='bots',
+                      postgresql_concurrently=True, if_exists=True)
@@ -2,8 +2,15 @@
 # models.py (versão avançada, inteligente e sincronizada com utils.py e app.py)
 # ================================
 from datetime import datetime, timezone
+from operator import attrgetter
+from typing import Optional
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Index, UniqueConstraint, func
+from sqlalchemy import (
+    Boolean, DateTime, Float, Index, Integer, Numeric, SmallInteger, String, Text, UniqueConstraint,
+    case, cast, func, insert, inspect, or_, select, text, update,
+)
+from sqlalchemy.orm import Mapped, load_only, mapped_column, raiseload, reconstructor, undefer_group
 
 # Inicializa o SQLAlchemy (injeção feita em app.py)
 db = SQLAlchemy()
@@ -14,6 +21,79 @@ def now_utc():
     return datetime.now(timezone.utc)
 
 
+def as_utc(dt):
+    """Normaliza para UTC-aware: colunas TIMESTAMP sem fuso (SQLite/patch antigo) voltam naive, tratadas como UTC."""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def request_now():
+    """
+    now_utc() memoizado por request (flask.g): todas as mutações/serializações de um
+    mesmo request enxergam o mesmo instante. Fora de request (monitor em background,
+    cujo app context dura o processo todo) cai no now_utc() normal.
+    """
+    if not has_request_context():
+        return now_utc()
+    ts = getattr(g, "_now_utc", None)
+    if ts is None:
+        ts = g._now_utc = now_utc()
+    return ts
+
+
+HEALTHY_MASK = 0b111
+
+
+def health_mask(token_ok, url_ok, webhook_ok) -> int:
+    """Resumo do diagnóstico num int: token<<2 | url<<1 | webhook (webhook None não conta como falha)."""
+    return ((token_ok is True) << 2) | ((url_ok is True) << 1) | (webhook_ok is not False)
+
+
+def _failure_ratio(failures, created_at, now) -> float:
+    if not created_at:
+        return float(failures or 0)
+    total_seconds = (now - created_at).total_seconds()
+    if total_seconds <= 0:
+        return float(failures or 0)
+    return round((failures or 0) / total_seconds, 6)
+
+
+# Chaves serializadas (mesma ordem de to_dict); usadas por serialize_many()
+_BASE_KEYS = ("id", "name", "token", "redirect_url", "status", "failures", "last_reason")
+_DIAG_KEYS = (
+    "last_token_ok", "last_url_ok", "last_webhook_ok", "last_token_http", "last_url_http",
+    "last_webhook_url", "last_webhook_error", "pending_update_count",
+)
+_META_KEYS = ("last_ok", "created_at", "updated_at", "last_webhook_error_at")
+# (with_meta, include_diag, sql_ratio) -> (chaves, select) — variantes de serialize_many
+_SERIALIZE_SELECTS = {}
+# (atributo do modelo, chave do diag) aplicados por apply_diag
+_DIAG_FIELDS = (
+    ("last_token_ok", "token_ok"),
+    ("last_url_ok", "url_ok"),
+    ("last_webhook_ok", "webhook_ok"),
+    ("last_token_http", "last_token_http"),
+    ("last_url_http", "last_url_http"),
+    ("last_webhook_url", "last_webhook_url"),
+    ("last_webhook_error", "last_webhook_error"),
+    ("pending_update_count", "pending_update_count"),
+    ("last_reason", "reason"),
+)
+# include_diag -> (chaves, attrgetter) usados por to_dict
+_TO_DICT_GETTERS = {
+    False: (_BASE_KEYS, attrgetter(*_BASE_KEYS)),
+    True: (_BASE_KEYS + _DIAG_KEYS, attrgetter(*(_BASE_KEYS + _DIAG_KEYS))),
+}
+_META_GETTER = attrgetter(*_META_KEYS)
+# Textos longos do webhook (erro/URL) fora do SELECT padrão; carregados juntos, sob demanda.
+# last_reason fica fora do grupo: está em _BASE_KEYS e todo to_dict() o lê (deferred = N+1)
+DETAIL_GROUP = "detalhe"
+_DEFERRED_ATTRS = frozenset(("last_webhook_url", "last_webhook_error"))
+
+
 class Bot(db.Model):
     """
     Representa um Bot monitorado no sistema TOK4.
@@ -34,55 +114,74 @@ class Bot(db.Model):
     __tablename__ = "bots"
 
     # ---------- Identificação ----------
-    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    name = db.Column(db.String(100), nullable=False, unique=True, index=True)
-    token = db.Column(db.String(255), nullable=False)  # obrigatório
-    redirect_url = db.Column(db.String(500), nullable=False, index=True)  # obrigatório
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(100), nullable=False, unique=True, index=True)
+    token: Mapped[str] = mapped_column(String(255), nullable=False)  # obrigatório
+    redirect_url: Mapped[str] = mapped_column(String(500), nullable=False, index=True)  # obrigatório
 
     # ---------- Status ----------
-    status = db.Column(db.String(20), default="reserva", index=True)  # ativo | reserva | inativo
+    status: Mapped[Optional[str]] = mapped_column(String(20), default="reserva", index=True)  # ativo | reserva | inativo
 
     # ---------- Monitoramento ----------
-    failures = db.Column(db.Integer, default=0, index=True)
-    last_ok = db.Column(db.DateTime(timezone=True), nullable=True, index=True)
-    last_reason = db.Column(db.Text, nullable=True)
+    failures: Mapped[Optional[int]] = mapped_column(Integer, default=0, index=True)
+    last_ok: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True, index=True)
+    last_reason: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
     # Diagnósticos técnicos
-    last_token_ok = db.Column(db.Boolean, nullable=True)
-    last_url_ok = db.Column(db.Boolean, nullable=True)
-    last_webhook_ok = db.Column(db.Boolean, nullable=True)
+    last_token_ok: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
+    last_url_ok: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
+    last_webhook_ok: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
+    # token<<2 | url<<1 | webhook (None conta como ok): 0b111 == saudável; indexável
+    health_mask: Mapped[Optional[int]] = mapped_column(SmallInteger, nullable=True, index=True)
 
     # Códigos HTTP
-    last_token_http = db.Column(db.Integer, nullable=True)
-    last_url_http = db.Column(db.Integer, nullable=True)
+    last_token_http: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    last_url_http: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     # Webhook details
-    last_webhook_url = db.Column(db.Text, nullable=True)
-    last_webhook_error = db.Column(db.Text, nullable=True)
-    last_webhook_error_at = db.Column(db.DateTime(timezone=True), nullable=True)
-    pending_update_count = db.Column(db.Integer, nullable=True)
+    last_webhook_url: Mapped[Optional[str]] = mapped_column(
+        Text, nullable=True, deferred=True, deferred_group=DETAIL_GROUP
+    )
+    last_webhook_error: Mapped[Optional[str]] = mapped_column(
+        Text, nullable=True, deferred=True, deferred_group=DETAIL_GROUP
+    )
+    last_webhook_error_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    pending_update_count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     # ---------- Timestamps ----------
-    created_at = db.Column(db.DateTime(timezone=True), default=now_utc, nullable=False, index=True)
-    updated_at = db.Column(db.DateTime(timezone=True), default=now_utc, onupdate=now_utc, nullable=False, index=True)
+    # relógio do banco (now()): o INSERT/UPDATE não leva o timestamp como parâmetro
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False, index=True
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False, index=True
+    )
 
     # ---------- Constraints & Indexes ----------
     __table_args__ = (
         UniqueConstraint("redirect_url", name="uq_bot_redirect_url"),
         Index("idx_status_failures", "status", "failures"),
         Index("idx_name_status", "name", "status"),
-        Index("idx_failures_updated", "failures", "updated_at"),
+        Index("idx_bots_reserva_updated", "updated_at", "id", postgresql_where=text("status = 'reserva'")),
+        Index("idx_bots_active", "id", postgresql_where=text("status = 'ativo'")),
+        Index("idx_bots_inactive", "failures", postgresql_where=text("status = 'inativo'")),
         {"sqlite_autoincrement": True},
     )
 
+    @reconstructor
+    def _init_on_load(self):
+        """created_at não muda depois do INSERT: o isoformat é calculado uma vez, ao carregar."""
+        created = self.__dict__.get("created_at")  # __dict__: não força load com load_only
+        self._created_iso = created.isoformat() if created else None
+
     # ====================================================
     # Métodos de Estado
     # ====================================================
-    def mark_active(self):
-        """Marca como ativo, reseta falhas e atualiza último sucesso."""
+    def mark_active(self, now: datetime = None):
+        """Marca como ativo, reseta falhas e atualiza último sucesso (`now`: relógio já lido no ciclo)."""
         self.status = "ativo"
         self.failures = 0
-        self.last_ok = now_utc()
+        self.last_ok = now or request_now()
         self.touch()
 
     def mark_reserve(self):
@@ -99,121 +198,326 @@ class Bot(db.Model):
         self.touch()
 
     def increment_failure(self):
-        """Incrementa contador de falhas consecutivas."""
-        self.failures = (self.failures or 0) + 1
+        """
+        Incrementa contador de falhas consecutivas. Expressão SQL (failures = failures + 1
+        no UPDATE), não ler-somar-gravar em Python: dois processos no mesmo bot não perdem
+        incremento. Depois do flush o atributo expira e é relido do banco se acessado.
+        """
+        self.failures = func.coalesce(type(self).failures, 0) + 1
         self.touch()
 
-    def reset_failures(self):
-        """Reseta contador de falhas e atualiza último sucesso."""
+    def reset_failures(self, now: datetime = None):
+        """Reseta contador de falhas e atualiza último sucesso (`now`: relógio já lido no ciclo)."""
         self.failures = 0
-        self.last_ok = now_utc()
+        self.last_ok = now or request_now()
         self.touch()
 
     def touch(self):
-        """Atualiza timestamp de atualização."""
-        self.updated_at = now_utc()
+        """Atualiza timestamp de atualização com o now() do banco (avaliado no UPDATE)."""
+        self.updated_at = func.now()
 
-    # ====================================================
-    # Métodos de Diagnóstico
-    # ====================================================
-    def apply_diag(self, diag: dict):
-        """Aplica resultados de diagnóstico ao registro."""
-        self.last_token_ok = diag.get("token_ok")
-        self.last_url_ok = diag.get("url_ok")
-        self.last_webhook_ok = diag.get("webhook_ok")
+    @classmethod
+    def bulk_mark(cls, status: str, ids, reason: str = None, now: datetime = None) -> int:
+        """
+        Transição de status em lote: um único UPDATE ... WHERE id IN (...) com as mesmas
+        regras de mark_active/mark_reserve/mark_inactive (não faz commit).
+        updated_at fica com o onupdate (now() do banco); `now` reaproveita o relógio do chamador
+        para last_ok. Retorna o nº de linhas afetadas.
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+        values = {"status": status}
+        if status != "inativo":
+            values["failures"] = 0
+        if status == "ativo":
+            values["last_ok"] = now or request_now()
+        if reason:
+            values["last_reason"] = reason
+        result = db.session.execute(
+            update(cls).where(cls.id.in_(ids)).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
 
-        self.last_token_http = diag.get("last_token_http")
-        self.last_url_http = diag.get("last_url_http")
+    @classmethod
+    def bulk_reset_failures(cls, ids, now: datetime = None) -> int:
+        """
+        reset_failures em lote (failures=0, last_ok=now) só para quem ainda está 'ativo':
+        não reescreve status, então um rebaixamento/troca feito no dashboard durante o
+        ciclo não é desfeito. Não faz commit; retorna o nº de linhas afetadas.
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+        result = db.session.execute(
+            update(cls).where(cls.id.in_(ids), cls.status == "ativo")
+            .values(failures=0, last_ok=now or request_now())
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
 
-        self.last_webhook_url = diag.get("last_webhook_url")
-        self.last_webhook_error = diag.get("last_webhook_error")
+    @classmethod
+    def bulk_increment_failures(cls, ids) -> int:
+        """
+        failures = failures + 1 calculado no banco, para vários bots num UPDATE só:
+        atômico (sem ler-somar-gravar em Python) e sem SELECT prévio. Não faz commit.
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+        result = db.session.execute(
+            update(cls).where(cls.id.in_(ids))
+            .values(failures=func.coalesce(cls.failures, 0) + 1)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
 
-        if diag.get("last_webhook_error_at"):
-            self.last_webhook_error_at = diag["last_webhook_error_at"]
+    @classmethod
+    def bulk_create(cls, items) -> list:
+        """
+        Insere vários bots num INSERT em lote (executemany com RETURNING), sem instanciar
+        Bot nem passar pelo unit of work. `items` são dicts de colunas. Não faz commit;
+        retorna os ids criados.
+        """
+        items = list(items)
+        if not items:
+            return []
+        return list(db.session.execute(insert(cls).returning(cls.id), items).scalars())
 
-        self.pending_update_count = diag.get("pending_update_count")
-        self.last_reason = diag.get("reason")
+    # ====================================================
+    # Métodos de Diagnóstico
+    # ====================================================
+    def apply_diag(self, diag: dict):
+        """
+        Aplica resultados de diagnóstico ao registro. Só atribui o que mudou: atributo
+        reatribuído com o mesmo valor não passa pelo __setattr__ instrumentado nem vai pro UPDATE.
+        Colunas deferred ainda não carregadas são gravadas direto (comparar dispararia um SELECT).
+        Aceita o diag completo de utils._run_diag: o last_reason sai dos *_reason quando
+        não vier "reason" pronto (sem o chamador montar um segundo dict).
+        """
+        reason = diag.get("reason")
+        if reason is None and "token_reason" in diag:
+            reason = (
+                f"T:{diag['token_reason']} | U:{diag.get('url_reason')} | "
+                f"P:{diag.get('probe_reason')} | W:{diag.get('webhook_reason')}"
+            )
+        unloaded = inspect(self).unloaded
+        for attr, key in _DIAG_FIELDS:
+            value = reason if key == "reason" else diag.get(key)
+            if (attr in _DEFERRED_ATTRS and attr in unloaded) or getattr(self, attr) != value:
+                setattr(self, attr, value)
+
+        mask = health_mask(self.last_token_ok, self.last_url_ok, self.last_webhook_ok)
+        if self.health_mask != mask:
+            self.health_mask = mask
+
+        error_at = diag.get("last_webhook_error_at")
+        if error_at and self.last_webhook_error_at != error_at:
+            self.last_webhook_error_at = error_at
 
     def is_healthy(self) -> bool:
-        """Avalia se o bot está saudável."""
-        return (
-            (self.last_token_ok is True)
-            and (self.last_url_ok is True)
-            and (self.last_webhook_ok in (True, None))
-        )
+        """Avalia se o bot está saudável (via health_mask; recalcula se ainda não gravado)."""
+        mask = self.health_mask
+        if mask is None:
+            mask = health_mask(self.last_token_ok, self.last_url_ok, self.last_webhook_ok)
+        return mask == HEALTHY_MASK
 
     def failure_ratio(self) -> float:
         """Calcula taxa de falhas relativa ao tempo de vida do bot."""
-        if not self.created_at:
-            return float(self.failures or 0)
-        total_seconds = (now_utc() - self.created_at).total_seconds()
-        if total_seconds <= 0:
-            return float(self.failures or 0)
-        return round((self.failures or 0) / total_seconds, 6)
+        return _failure_ratio(self.failures, self.created_at, request_now())
 
     # ====================================================
     # Consultas Utilitárias
     # ====================================================
+    # select() 2.0 em vez do Query legado: o SQL compilado sai do cache de statements
     @classmethod
     def get_active(cls):
-        return cls.query.filter_by(status="ativo").all()
+        return db.session.scalars(select(cls).where(cls.status == "ativo")).all()
 
     @classmethod
     def get_reserve(cls):
-        return cls.query.filter_by(status="reserva").all()
+        return db.session.scalars(select(cls).where(cls.status == "reserva")).all()
 
     @classmethod
     def get_inactive(cls):
-        return cls.query.filter_by(status="inativo").all()
+        return db.session.scalars(select(cls).where(cls.status == "inativo")).all()
+
+    @classmethod
+    def by_status(cls, statuses=("ativo", "reserva", "inativo")) -> dict:
+        """
+        Bots agrupados por status numa única consulta (IN), em vez de um get_* por status.
+        Retorna {status: [bots...]} com todas as chaves pedidas, mesmo vazias.
+        """
+        groups = {s: [] for s in statuses}
+        # raiseload("*"): relacionamento futuro acessado por bot vira erro, não N+1 silencioso
+        stmt = select(cls).options(raiseload("*")).where(cls.status.in_(statuses)).order_by(cls.id)
+        for bot in db.session.scalars(stmt):
+            groups[bot.status].append(bot)
+        return groups
+
+    @classmethod
+    def load_all_indexed(cls, key: str = "name", ids=None) -> dict:
+        """
+        Conjunto de trabalho numa consulta só, indexado por `key` ({bot.name: bot} por padrão):
+        o chamador resolve cada bot por dict em vez de um SELECT por bot. `ids` restringe o conjunto.
+        """
+        stmt = select(cls).options(raiseload("*"))
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return {}
+            stmt = stmt.where(cls.id.in_(ids))
+        getter = attrgetter(key)
+        return {getter(bot): bot for bot in db.session.scalars(stmt)}
+
+    @classmethod
+    def pick_reserve(cls, exclude_id: int = None):
+        """
+        Próximo bot da reserva para substituição, travado com FOR UPDATE SKIP LOCKED:
+        duas trocas concorrentes nunca pegam o mesmo reserva (no-op fora do Postgres).
+        Escolhe o reserva parado há mais tempo (updated_at, id) — coberto pelo índice
+        parcial idx_bots_reserva_updated. Já traz o grupo de detalhe: as rotas de troca
+        serializam o reserva promovido com to_dict() completo.
+        """
+        stmt = select(cls).options(undefer_group(DETAIL_GROUP)).where(cls.status == "reserva")
+        if exclude_id is not None:
+            stmt = stmt.where(cls.id != exclude_id)
+        stmt = stmt.order_by(cls.updated_at.asc(), cls.id.asc()).limit(1).with_for_update(skip_locked=True)
+        return db.session.scalars(stmt).first()
+
+    @classmethod
+    def get_detail(cls, bot_id: int):
+        """Bot por PK já com as colunas deferred do grupo de detalhe (um SELECT só)."""
+        return db.session.get(cls, bot_id, options=[undefer_group(DETAIL_GROUP)])
 
     @classmethod
     def get_oldest_updated(cls):
-        return cls.query.order_by(cls.updated_at.asc()).first()
+        return db.session.scalars(select(cls).order_by(cls.updated_at.asc()).limit(1)).first()
+
+    @classmethod
+    def worst_offenders(cls, limit: int = 10):
+        """
+        Piores bots: mais falhas primeiro, e entre empatados o atualizado há mais tempo.
+        A ordem bate com idx_failures_updated (failures DESC, updated_at ASC): sai do índice, sem sort.
+        Carrega exatamente as colunas de to_dict(include_diag=False): nenhum lazy load por linha
+        (raiseload só cobre relacionamentos, não colunas deferred/expiradas).
+        """
+        stmt = (
+            select(cls)
+            .options(load_only(*(getattr(cls, k) for k in _BASE_KEYS + _META_KEYS)), raiseload("*"))
+            .order_by(cls.failures.desc(), cls.updated_at.asc())
+            .limit(limit)
+        )
+        return db.session.scalars(stmt).all()
+
+    @classmethod
+    def status_counts(cls) -> dict:
+        """Conta bots por status numa única consulta agregada (sem carregar linhas)."""
+        rows = db.session.query(cls.status, func.count(cls.id)).group_by(cls.status).all()
+        return {status: total for status, total in rows}
 
     @classmethod
     def stats(cls):
+        """
+        Totais do painel numa única varredura: total, contagem por status, soma de falhas
+        e última atualização. COUNT(*) FILTER no Postgres; SUM(CASE) nos demais bancos.
+        """
+        if db.session.get_bind().dialect.name == "postgresql":
+            def count_status(status):
+                return func.count().filter(cls.status == status)
+        else:
+            def count_status(status):
+                return func.coalesce(func.sum(case((cls.status == status, 1), else_=0)), 0)
+
         return db.session.query(
             func.count(cls.id).label("total"),
+            count_status("ativo").label("ativos"),
+            count_status("reserva").label("reserva"),
+            count_status("inativo").label("inativos"),
             func.sum(cls.failures).label("total_failures"),
             func.max(cls.updated_at).label("last_update"),
-        ).first()
+        ).one()
 
     # ====================================================
     # Serialização
     # ====================================================
     def to_dict(self, with_meta: bool = True, include_diag: bool = True) -> dict:
-        base = {
-            "id": self.id,
-            "name": self.name,
-            "token": self.token,
-            "redirect_url": self.redirect_url,
-            "status": self.status,
-            "failures": self.failures,
-            "last_reason": self.last_reason,
-        }
-
-        if include_diag:
-            base.update({
-                "last_token_ok": self.last_token_ok,
-                "last_url_ok": self.last_url_ok,
-                "last_webhook_ok": self.last_webhook_ok,
-                "last_token_http": self.last_token_http,
-                "last_url_http": self.last_url_http,
-                "last_webhook_url": self.last_webhook_url,
-                "last_webhook_error": self.last_webhook_error,
-                "pending_update_count": self.pending_update_count,
-            })
-
+        # getter pré-montado por variante: um attrgetter (C) + um dict(zip) em vez de 3 updates
+        keys, getter = _TO_DICT_GETTERS[bool(include_diag)]
+        data = dict(zip(keys, getter(self)))
         if with_meta:
-            base.update({
-                "last_ok": self.last_ok.isoformat() if self.last_ok else None,
-                "created_at": self.created_at.isoformat() if self.created_at else None,
-                "updated_at": self.updated_at.isoformat() if self.updated_at else None,
-                "last_webhook_error_at": self.last_webhook_error_at.isoformat() if self.last_webhook_error_at else None,
-                "failure_ratio": self.failure_ratio(),
-            })
+            created_iso = self.__dict__.get("_created_iso")  # cacheado no load (reconstructor)
+            for k, v in zip(_META_KEYS, _META_GETTER(self)):
+                if k == "created_at" and created_iso is not None:
+                    data[k] = created_iso
+                else:
+                    data[k] = v.isoformat() if v else None
+            data["failure_ratio"] = self.failure_ratio()
+        return data
 
-        return base
+    @classmethod
+    def failure_ratio_expr(cls):
+        """
+        failure_ratio calculado pelo Postgres (uma leitura de relógio no servidor, divisão em C),
+        com a mesma regra de failure_ratio(): sem created_at ou idade <= 0, devolve as falhas.
+        """
+        failures = func.coalesce(cls.failures, 0)
+        # EXTRACT devolve double precision no PG < 14 (numeric no 14+): cast explícito, senão
+        # numeric/double vira double e round(double precision, integer) não existe
+        age = cast(func.extract("epoch", func.now() - cls.created_at), Numeric)
+        return case(
+            (or_(cls.created_at.is_(None), age <= 0), cast(failures, Float)),
+            else_=cast(func.round(cast(failures, Numeric) / age, 6), Float),
+        )
+
+    @classmethod
+    def serialize_many(cls, with_meta: bool = True, include_diag: bool = True,
+                       iso_datetimes: bool = True) -> list:
+        """
+        Mesmo formato de to_dict() para todos os bots, via SELECT de colunas (Core):
+        sem hidratar instâncias ORM nem passar pelo identity map — usado pelo /api/bots.
+        No Postgres o failure_ratio já vem calculado na própria consulta.
+        iso_datetimes=False devolve os datetime crus, para um encoder que os serialize
+        em C (orjson gera o mesmo texto do isoformat()).
+        """
+        sql_ratio = with_meta and db.session.get_bind().dialect.name == "postgresql"
+        keys, stmt = cls._serialize_select(with_meta, include_diag, sql_ratio)
+        rows = db.session.execute(stmt).all()
+        if not with_meta:
+            return [dict(zip(keys, row)) for row in rows]
+
+        n = len(keys)
+        created_idx = n + _META_KEYS.index("created_at")
+        ratio_idx = n + len(_META_KEYS)
+        now = request_now()
+        payload = []
+        for row in rows:
+            d = dict(zip(keys, row))
+            if iso_datetimes:
+                for k, v in zip(_META_KEYS, row[n:]):
+                    d[k] = v.isoformat() if v else None
+            else:
+                d.update(zip(_META_KEYS, row[n:]))
+            if sql_ratio:
+                d["failure_ratio"] = row[ratio_idx]
+            else:
+                d["failure_ratio"] = _failure_ratio(d["failures"], row[created_idx], now)
+            payload.append(d)
+        return payload
+
+    @classmethod
+    def _serialize_select(cls, with_meta: bool, include_diag: bool, sql_ratio: bool = False):
+        """(chaves, select) de cada variante de serialize_many, montados uma vez e reaproveitados."""
+        variant = (with_meta, include_diag, sql_ratio)
+        cached = _SERIALIZE_SELECTS.get(variant)
+        if cached is None:
+            keys = _BASE_KEYS + (_DIAG_KEYS if include_diag else ())
+            cols = [getattr(cls, k) for k in keys + (_META_KEYS if with_meta else ())]
+            if sql_ratio:
+                cols.append(cls.failure_ratio_expr())
+            cached = _SERIALIZE_SELECTS[variant] = (keys, select(*cols).order_by(cls.id))
+        return cached
 
     # ====================================================
     # Representação
@@ -223,4 +527,8 @@ class Bot(db.Model):
             f"<Bot id={self.id} name='{self.name}' "
             f"status='{self.status}' failures={self.failures} "
             f"last_ok={self.last_ok} updated_at={self.updated_at}>"
-        )
\ No newline at end of file
+        )
+
+
+# Índice com direção por coluna (precisa dos atributos já mapeados, por isso fora de __table_args__)
+Index("idx_failures_updated", Bot.failures.desc(), Bot.updated_at.asc())
@@ -1,12 +1,17 @@
 import os
 import time
+import hashlib
 import logging
-import requests
-from twilio.rest import Client
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from sqlalchemy.exc import SQLAlchemyError
 
-from utils import check_link, check_token, check_probe, log_event
-from models import db, Bot
+from utils import (
+    check_link, check_token, check_probe, log_event, enqueue_whatsapp, cache_get_json, cache_set_json,
+    cache_claim, cache_delete,
+)
+from flask import Flask
+from models import db, Bot, now_utc
 
 # ================================
 # Configuração de logging
@@ -29,54 +34,52 @@ ADMIN_WHATSAPP = os.getenv("ADMIN_WHATSAPP")  # Seu número WhatsApp com prefixo
 
 # Chat de monitoramento no Telegram
 MONITOR_CHAT_ID = os.getenv("MONITOR_CHAT_ID")
+DATABASE_URL = os.getenv("DATABASE_URL")
 
-# ================================
-# Setup Twilio
-# ================================
-twilio_client = Client(TWILIO_SID, TWILIO_AUTH)
+# Pool do processo standalone (fica dias no ar): pre_ping descarta a conexão que o
+# Postgres/Railway derrubou antes de usá-la; recycle renova antes do timeout ocioso do servidor
+DB_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+    "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": True,
+}
+
+# Checagens são só espera de rede: os bots do ciclo são diagnosticados em paralelo
+MONITOR_WORKERS = int(os.getenv("MONITOR_WORKERS", "32"))
+EXECUTOR = ThreadPoolExecutor(max_workers=MONITOR_WORKERS, thread_name_prefix="tok4-monitor")
+# Intervalo entre ciclos do monitor (segundos)
+MONITOR_INTERVAL = int(os.getenv("MONITOR_INTERVAL", "60"))
+# Diagnóstico OK compartilhado via Redis entre réplicas: metade do intervalo, então expira
+# antes do próximo ciclo desta instância (que sempre checa de novo); falha nunca vem do cache
+DIAG_CACHE_TTL = int(os.getenv("DIAG_CACHE_TTL", str(MONITOR_INTERVAL // 2)))
+# Bot instável: no máximo um alerta de falha por bot a cada N segundos (gate no Redis)
+ALERT_DEDUP_SECONDS = int(os.getenv("ALERT_DEDUP_SECONDS", "900"))
+# Corpo do alerta de falha: template montado uma vez, preenchido com o diag + dados do bot
+_ALERT_TEMPLATE = (
+    "⚠️ Bot com problema!\n\n"
+    "Nome: {name}\n"
+    "URL: {url}\n"
+    "Falhas: {failures}\n\n"
+    "Token: {token_reason}\n"
+    "URL: {url_reason}\n"
+    "Probe: {probe_reason}"
+)
 
 # ================================
 # Funções auxiliares
 # ================================
 def send_whatsapp(msg: str):
-    """Envia mensagem para o WhatsApp via Twilio"""
-    try:
-        twilio_client.messages.create(
-            body=msg,
-            from_=f"whatsapp:{TWILIO_FROM}",
-            to=f"whatsapp:{ADMIN_WHATSAPP}"
-        )
-        logging.info("📲 Mensagem enviada ao WhatsApp")
-    except Exception as e:
-        logging.error(f"❌ Erro ao enviar WhatsApp: {e}")
-
-
-def carregar_links_typebot():
-    """Busca os links do flow no Typebot (para debug/validação externa)"""
-    try:
-        url = f"{TYPEBOT_API}/bots/{TYPEBOT_FLOW_ID}"
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-
-        links = [
-            block["content"]["url"]
-            for block in data.get("blocks", [])
-            if block.get("type") == "redirect"
-        ]
-        return links
-    except Exception as e:
-        logging.error(f"❌ Erro ao carregar links do Typebot: {e}")
-        send_whatsapp(f"⚠️ Erro ao carregar links do Typebot: {e}")
-        return []
+    """Enfileira a mensagem para o WhatsApp (Twilio): envio na thread de notificação, sem travar o ciclo"""
+    enqueue_whatsapp(msg)
 
 
 def get_bots_from_db():
     """Carrega os bots do banco e separa por status"""
     try:
-        ativos = Bot.query.filter_by(status="ativo").all()
-        reserva = Bot.query.filter_by(status="reserva").all()
-        return ativos, reserva
+        groups = Bot.by_status(("ativo", "reserva"))
+        return groups["ativo"], groups["reserva"]
     except SQLAlchemyError as e:
         logging.error(f"❌ Erro ao consultar banco: {e}")
         return [], []
@@ -90,42 +93,69 @@ def diagnosticar_bot(bot):
     - Probe (mensagem no grupo)
     Retorna um dict com o diagnóstico.
     """
+    return _diagnosticar(bot.token, bot.redirect_url)
+
+
+def _diagnosticar(token, redirect_url):
+    """Checagens só com valores simples (sem tocar no ORM): seguro para rodar no EXECUTOR."""
+    # chave por hash: o token não vai em claro para o Redis
+    digest = hashlib.blake2b(f"{token}|{redirect_url}".encode(), digest_size=8).hexdigest()
+    cache_key = f"diag:{digest}"
+    cached = cache_get_json(cache_key)
+    if cached is not None:
+        return cached
+
     diag = {}
 
     # Token
-    token_ok, token_reason, username = check_token(bot.token or "")
+    token_ok, token_reason, username = check_token(token or "")
     diag["token_ok"] = token_ok
     diag["token_reason"] = token_reason
     diag["username"] = username
 
     # URL
-    url_ok, url_reason = check_link(bot.redirect_url or "")
+    url_ok, url_reason = check_link(redirect_url or "")
     diag["url_ok"] = url_ok
     diag["url_reason"] = url_reason
 
     # Probe
-    probe_ok, probe_reason = check_probe(bot.token, MONITOR_CHAT_ID)
+    probe_ok, probe_reason = check_probe(token, MONITOR_CHAT_ID)
     diag["probe_ok"] = probe_ok
     diag["probe_reason"] = probe_reason
 
     # Decisão final
-    diag["decision_ok"] = token_ok and url_ok and (probe_ok or probe_ok is None)
+    # token inconclusivo (bulkhead cheio, saturação local): decisão None, o ciclo pula o bot
+    diag["decision_ok"] = None if token_ok is None else token_ok and url_ok and (probe_ok or probe_ok is None)
 
+    # só o OK vai para o cache: bot com problema é rechecado a cada ciclo (falhas contam de verdade)
+    if DIAG_CACHE_TTL > 0 and diag["decision_ok"]:
+        cache_set_json(cache_key, diag, DIAG_CACHE_TTL)
     return diag
 
 
 # ================================
 # Loop principal de monitoramento
 # ================================
-def monitor_loop(interval: int = 60):
+def _sleep_until_next_cycle(cycle_start: float, interval: int):
+    """Dorme só o que falta do intervalo (relógio monotônico): o período não acumula a duração do ciclo."""
+    elapsed = time.monotonic() - cycle_start
+    if elapsed > interval:
+        logging.warning(
+            f"⏱️ Ciclo levou {elapsed:.1f}s (> intervalo de {interval}s): "
+            f"aumente MONITOR_WORKERS ou reduza a quantidade de bots"
+        )
+        return
+    time.sleep(interval - elapsed)
+
+
+def monitor_loop(interval: int = MONITOR_INTERVAL):
     """Loop de monitoramento dos bots"""
     logging.info("🔄 Carregando bots do banco...")
     ativos, reserva = get_bots_from_db()
 
     # Se não tem ativos, ativa 2 da reserva
     if not ativos and reserva:
-        for bot in reserva[:2]:
-            bot.mark_active()
+        Bot.bulk_mark("ativo", [bot.id for bot in reserva[:2]])
         try:
             db.session.commit()
             ativos, reserva = get_bots_from_db()
@@ -134,65 +164,104 @@ def monitor_loop(interval: int = 60):
             logging.error(f"❌ Erro ao ativar bots iniciais: {e}")
 
     logging.info(f"✅ Monitoramento iniciado | Ativos: {len(ativos)} | Reserva: {len(reserva)}")
+    reserva = deque(reserva)  # fila: popleft O(1) na troca
     send_whatsapp("🚀 Monitor do Typebot iniciado com sucesso!")
 
     # Loop infinito de verificação
     while True:
-        for bot in list(ativos):
+        cycle_start = time.monotonic()
+        # Rede em paralelo no EXECUTOR; sessão/ORM só nesta thread. Os atributos são lidos
+        # aqui (antes do submit) para os workers não dispararem refresh do ORM.
+        futures = {}
+        for bot in ativos:
             logging.info(f"🔎 Checando bot {bot.name} → {bot.redirect_url}")
+            futures[EXECUTOR.submit(_diagnosticar, bot.token, bot.redirect_url)] = bot
 
-            diag = diagnosticar_bot(bot)
+        # Transições do ciclo acumuladas e gravadas no fim: poucos UPDATE ... WHERE id IN (...)
+        # e um único commit, em vez de um commit por bot
+        ok_ids, fail_ids, reserve_ids, activate_ids = [], [], [], []
+        swaps = []
+        for fut in as_completed(futures):
+            bot = futures[fut]
+            try:
+                diag = fut.result()
+            except Exception as e:
+                logging.error(f"❌ Erro ao diagnosticar {bot.name}: {e}")
+                continue
 
+            if diag["decision_ok"] is None:
+                logging.info(f"⏸️ {bot.name}: checagem inconclusiva ({diag['token_reason']}), fica para o próximo ciclo")
+                continue
             if diag["decision_ok"]:
-                bot.reset_failures()
-                try:
-                    db.session.commit()
-                except SQLAlchemyError as e:
-                    db.session.rollback()
-                    logging.error(f"❌ Erro ao salvar status OK no banco: {e}")
+                ok_ids.append(bot.id)
                 continue
 
-            # Falha detectada
-            bot.increment_failure()
-            logging.warning(f"⚠️ Falha detectada no bot {bot.name} ({bot.failures}x)")
-            send_whatsapp(f"⚠️ Bot com problema!\n\n"
-                          f"Nome: {bot.name}\n"
-                          f"URL: {bot.redirect_url}\n"
-                          f"Falhas: {bot.failures}\n\n"
-                          f"Token: {diag['token_reason']}\n"
-                          f"URL: {diag['url_reason']}\n"
-                          f"Probe: {diag['probe_reason']}")
+            # Falha detectada (incremento feito no banco; aqui só o valor para log/decisão)
+            failures = (bot.failures or 0) + 1
+            fail_ids.append(bot.id)
+            logging.warning(f"⚠️ Falha detectada no bot {bot.name} ({failures}x)")
+            if cache_claim(f"alert:{bot.id}", ALERT_DEDUP_SECONDS):
+                send_whatsapp(_ALERT_TEMPLATE.format_map(
+                    {**diag, "name": bot.name, "url": bot.redirect_url, "failures": failures}
+                ))
 
             # Após X falhas → troca por reserva
-            if bot.failures >= 3:
-                bot.mark_reserve()
-                try:
-                    db.session.commit()
-                except SQLAlchemyError as e:
-                    db.session.rollback()
-                    logging.error(f"❌ Erro ao atualizar bot {bot.name} como reserva: {e}")
-                if bot in ativos:
-                    ativos.remove(bot)
-
-                if reserva:
-                    novo = reserva.pop(0)
-                    novo.mark_active()
-                    try:
-                        db.session.commit()
-                        ativos.append(novo)
-                        send_whatsapp(f"🔄 Substituído automaticamente!\n\n"
-                                      f"Novo Ativo: {novo.name}\nURL: {novo.redirect_url}")
-                    except SQLAlchemyError as e:
-                        db.session.rollback()
-                        logging.error(f"❌ Erro ao ativar novo bot {novo.name}: {e}")
-                else:
-                    send_whatsapp("❌ Não há mais bots na reserva!")
-
-        time.sleep(interval)
+            if failures >= 3:
+                reserve_ids.append(bot.id)
+                novo = reserva.popleft() if reserva else None
+                if novo:
+                    activate_ids.append(novo.id)
+                swaps.append((bot, novo))
+
+        try:
+            now = now_utc()  # um relógio por ciclo para todos os last_ok
+            Bot.bulk_reset_failures(ok_ids, now=now)  # sem reescrever status (dashboard pode ter mudado)
+            Bot.bulk_increment_failures(fail_ids)
+            Bot.bulk_mark("reserva", reserve_ids)
+            Bot.bulk_mark("ativo", activate_ids, now=now)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logging.error(f"❌ Erro ao gravar resultados do ciclo no banco: {e}")
+            # nada foi gravado: devolve os reservas escolhidos para a fila
+            reserva.extendleft(reversed([novo for _, novo in swaps if novo]))
+            _sleep_until_next_cycle(cycle_start, interval)
+            continue
+
+        # bot recuperado: libera o próximo alerta dele (um DEL para todos)
+        cache_delete(*(f"alert:{bot_id}" for bot_id in ok_ids))
+
+        # remove os trocados numa passada só, em vez de um list.remove O(N) por bot
+        # (set de instâncias: hash por identidade, sem tocar atributos expirados pelo commit)
+        if swaps:
+            swapped = {bot for bot, _ in swaps}
+            ativos = [b for b in ativos if b not in swapped]
+        for bot, novo in swaps:
+            if novo:
+                ativos.append(novo)
+                send_whatsapp(f"🔄 Substituído automaticamente!\n\n"
+                              f"Novo Ativo: {novo.name}\nURL: {novo.redirect_url}")
+            else:
+                send_whatsapp("❌ Não há mais bots na reserva!")
+
+        _sleep_until_next_cycle(cycle_start, interval)
 
 
 # ================================
 # EntryPoint
 # ================================
+def create_monitor_app() -> Flask:
+    """App mínimo só para o db.session do monitor standalone (sem rotas)."""
+    if not DATABASE_URL:
+        raise RuntimeError("❌ DATABASE_URL não configurado!")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = DB_ENGINE_OPTIONS
+    db.init_app(app)
+    return app
+
+
 if __name__ == "__main__":
-    monitor_loop()
\ No newline at end of file
+    with create_monitor_app().app_context():
+        monitor_loop()
\ No newline at end of file
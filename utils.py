@@ -2,10 +2,24 @@
 # utils.py (versão avançada e robusta, sincronizado com app.py)
 # ================================
 import os
+import re
+import json
+import hashlib
+import time
 import logging
+import threading
+import functools
 import requests
-from datetime import datetime
-from twilio.rest import Client
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from cachetools import LRUCache
+try:
+    import orjson
+except ImportError:  # opcional: sem orjson, parse com o json da stdlib
+    orjson = None
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sqlalchemy.exc import SQLAlchemyError
 
 from models import db, Bot
@@ -33,33 +47,277 @@ ADMIN_WHATSAPP = os.getenv("ADMIN_WHATSAPP")
 
 MONITOR_CHAT_ID = os.getenv("MONITOR_CHAT_ID")
 
+# Parse das respostas (Bot API, Typebot, Redis): orjson direto dos bytes, em C, se instalado
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+TELEGRAM_API = "https://api.telegram.org"
+# O pool por host nunca fica menor que o nº de threads de checagem (MONITOR_MAX_WORKERS),
+# senão o urllib3 descarta conexões ("Connection pool is full") e o keep-alive se perde
+_MONITOR_MAX_WORKERS = int(os.getenv("MONITOR_MAX_WORKERS", "8"))
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", str(max(32, _MONITOR_MAX_WORKERS))))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", str(max(64, _MONITOR_MAX_WORKERS * 2))))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+CHECK_TIMEOUT = float(os.getenv("CHECK_TIMEOUT", "8"))
+# (connect, read): a fase de conexão tem limite próprio, menor que o de leitura
+CHECK_TIMEOUTS = (HTTP_CONNECT_TIMEOUT, CHECK_TIMEOUT)
+# Notificações WhatsApp: fila com coalescência (1 envio por janela) e descarte dos mais antigos
+NOTIFY_FLUSH_SECONDS = float(os.getenv("NOTIFY_FLUSH_SECONDS", "5"))
+NOTIFY_QUEUE_MAX = int(os.getenv("NOTIFY_QUEUE_MAX", "100"))
+WHATSAPP_MAX_BODY = 1600  # limite de caracteres do body no Twilio
+# Circuit breaker da Bot API: N falhas transitórias seguidas → sem chamadas por X segundos
+CIRCUIT_FAIL_THRESHOLD = int(os.getenv("CIRCUIT_FAIL_THRESHOLD", "5"))
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "60"))
+# Chamadas simultâneas à Bot API por categoria (probe x consultas) e espera máx. por uma vaga
+TG_PROBE_CONCURRENCY = int(os.getenv("TG_PROBE_CONCURRENCY", "4"))
+TG_QUERY_CONCURRENCY = int(os.getenv("TG_QUERY_CONCURRENCY", "32"))
+TG_BULKHEAD_WAIT_SECONDS = float(os.getenv("TG_BULKHEAD_WAIT_SECONDS", "5"))
+# Pool das checagens de diagnosticar_bot (4 por bot, em paralelo)
+DIAG_POOL_WORKERS = int(os.getenv("DIAG_POOL_WORKERS", "8"))
+# Orçamento total de um diagnosticar_bot (todas as checagens), em vez de timeouts somados
+DIAG_BUDGET_SECONDS = float(os.getenv("DIAG_BUDGET_SECONDS", "10"))
+# Redis opcional (cache compartilhado entre workers); sem REDIS_URL tudo segue sem cache
+REDIS_URL = os.getenv("REDIS_URL")
+TYPEBOT_LINKS_TTL = int(os.getenv("TYPEBOT_LINKS_TTL", "60"))
+# Token válido raramente deixa de ser: TTL longo, e o cache cai na hora se o probe/webhook
+# do mesmo token receber 401/403 (ver _invalidate_on_auth_error)
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "600"))
+# TTL negativo (como o negative_ttl do Squid): falhas ficam pouco tempo em cache
+HEALTH_CACHE_ERR_TTL = float(os.getenv("HEALTH_CACHE_ERR_TTL", "5"))
+LINK_CACHE_TTL = float(os.getenv("LINK_CACHE_TTL", "30"))
+# Teto de entradas dos caches/estados por bot (LRU): memória limitada mesmo com muitos tokens
+MAX_TRACKED_BOTS = int(os.getenv("MAX_TRACKED_BOTS", "1024"))
+
+# Formato do token do BotFather (<id numérico>:<segredo>): barra tokens digitados errado sem ir à rede
+_TOKEN_RE = re.compile(r"^\d{5,}:[A-Za-z0-9_-]{30,}$")
+# redirect_url sem http(s):// ou sem host falharia só no timeout: barrada antes da rede
+_URL_SCHEMES = frozenset(("http", "https"))
+# A Bot API serializa sem espaços e sempre começa por {"ok":true/false,...}
+_TG_OK_MARKER = b'"ok":true'
+# check_link só lê status: identity dispensa o servidor de comprimir (e nós de descomprimir)
+_LINK_HEADERS = {"Accept-Encoding": "identity"}
+
+# Cache de getMe: hash do token -> (monotonic_ts, resultado); TTL depende de OK/falha
+_health_cache = LRUCache(maxsize=MAX_TRACKED_BOTS)
+_health_cache_lock = threading.Lock()
+# Cache de check_link: url -> (monotonic_ts, resultado)
+_link_cache = LRUCache(maxsize=MAX_TRACKED_BOTS)
+_link_cache_lock = threading.Lock()
+
+# ================================
+# Sessão HTTP (keep-alive + pool dimensionado)
+# ================================
+def make_requests_session() -> requests.Session:
+    """
+    Cria uma Session com pool de conexões maior que o padrão (10) do urllib3.
+    Reaproveita conexões TCP/TLS entre checagens (keep-alive é o padrão da Session).
+    """
+    retry = Retry(total=1, connect=1, read=0, status=0, backoff_factor=0.2)
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=False,
+        max_retries=retry,
+    )
+    # Adapter só do Telegram (host único): um pool cujas conexões não disputam
+    # espaço com as redirect_urls e por isso sobrevivem entre ciclos
+    telegram_adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=False,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.mount(f"{TELEGRAM_API}/", telegram_adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+requests_session = make_requests_session()
+
+
+def warm_up_telegram():
+    """Abre (e devolve ao pool) uma conexão com api.telegram.org antes do 1º ciclo."""
+    try:
+        requests_session.head(TELEGRAM_API, timeout=5)
+        logger.debug("🔥 Conexão com api.telegram.org pré-aquecida")
+    except Exception as e:
+        logger.warning(f"⚠️ Pré-aquecimento do api.telegram.org falhou: {e}")
+
+# ================================
+# Redis (opcional)
+# ================================
+@functools.lru_cache(maxsize=1)
+def get_redis():
+    """
+    Client Redis único, criado no primeiro uso (None sem REDIS_URL ou sem o pacote).
+    Timeout curto: o cache é otimização, nunca pode travar a checagem.
+    """
+    if not REDIS_URL:
+        return None
+    try:
+        import redis
+        return redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    except Exception as e:
+        logger.error(f"❌ Erro ao configurar Redis: {e}")
+        return None
+
+
+def cache_get_json(key: str):
+    """GET + parse JSON no Redis; None em miss, sem Redis ou com Redis fora do ar."""
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        raw = client.get(key)
+        return _json_loads(raw) if raw is not None else None
+    except Exception as e:
+        logger.debug(f"Redis GET {key} falhou: {e}")
+        return None
+
+
+def cache_set_json(key: str, value, ttl: int):
+    """SETEX com o valor em JSON; falha do Redis só é logada."""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.setex(key, ttl, json.dumps(value))
+    except Exception as e:
+        logger.debug(f"Redis SETEX {key} falhou: {e}")
+
+def cache_claim(key: str, ttl: int) -> bool:
+    """
+    SET key NX EX ttl: True só para quem criou a chave (janela de dedupe).
+    Sem Redis (ou com erro) devolve True — na dúvida o alerta sai.
+    """
+    client = get_redis()
+    if client is None:
+        return True
+    try:
+        return bool(client.set(key, 1, ex=ttl, nx=True))
+    except Exception as e:
+        logger.debug(f"Redis SET NX {key} falhou: {e}")
+        return True
+
+
+def cache_delete(*keys):
+    """DEL de várias chaves num round-trip; falha do Redis só é logada."""
+    client = get_redis()
+    if client is None or not keys:
+        return
+    try:
+        client.delete(*keys)
+    except Exception as e:
+        logger.debug(f"Redis DEL falhou: {e}")
+
 # ================================
-# Setup Twilio
+# Setup Twilio (instância única, compartilhada por app.py e monitor.py)
 # ================================
-twilio_client = None
-if TWILIO_SID and TWILIO_AUTH:
+@functools.lru_cache(maxsize=1)
+def get_twilio_client():
+    """
+    Client do Twilio criado no primeiro envio e reaproveitado depois (None sem credenciais).
+    O SDK só é importado aqui: boot e workers que nunca alertam não pagam esse custo.
+    """
+    if not (TWILIO_SID and TWILIO_AUTH):
+        return None
     try:
-        twilio_client = Client(TWILIO_SID, TWILIO_AUTH)
+        from twilio.rest import Client
+        from twilio.http.http_client import TwilioHttpClient
+
+        # pool_connections=True: a Session interna do Twilio mantém o TLS vivo entre envios
+        return Client(
+            TWILIO_SID, TWILIO_AUTH,
+            http_client=TwilioHttpClient(pool_connections=True, timeout=CHECK_TIMEOUT),
+        )
     except Exception as e:
         logger.error(f"❌ Erro ao configurar Twilio: {e}")
+        return None
 
 # ================================
 # Funções auxiliares
 # ================================
+@functools.lru_cache(maxsize=1)
+def get_admin_whatsapps() -> tuple:
+    """
+    Destinos WhatsApp dos admins (ADMIN_WHATSAPP aceita vários, separados por vírgula),
+    já no formato "whatsapp:+55...". O env é estático após o boot: parse feito uma vez.
+    """
+    numbers = [n.strip() for n in (ADMIN_WHATSAPP or "").split(",")]
+    return tuple(f"whatsapp:{n}" for n in numbers if n)
+
+
 def send_whatsapp(msg: str):
     """Envia mensagem formatada via WhatsApp (Twilio)."""
-    if not twilio_client:
+    client = get_twilio_client()
+    if not client or not (TWILIO_FROM and get_admin_whatsapps()):
         logger.warning("⚠️ Twilio não configurado.")
         return
-    try:
-        twilio_client.messages.create(
-            body=msg,
-            from_=f"whatsapp:{TWILIO_FROM}",
-            to=f"whatsapp:{ADMIN_WHATSAPP}"
-        )
-        logger.info("📲 WhatsApp enviado")
-    except Exception as e:
-        logger.error(f"❌ Erro ao enviar WhatsApp: {e}")
+    for to in get_admin_whatsapps():
+        try:
+            client.messages.create(
+                body=msg,
+                from_=f"whatsapp:{TWILIO_FROM}",
+                to=to
+            )
+            logger.info("📲 WhatsApp enviado")
+        except Exception as e:
+            logger.error(f"❌ Erro ao enviar WhatsApp para {to}: {e}")
+
+
+# ================================
+# Fila de notificações (coalescência)
+# ================================
+# deque(maxlen): cheia, o append descarta a mensagem mais antiga
+_notify_queue = deque(maxlen=NOTIFY_QUEUE_MAX)
+_notify_lock = threading.Lock()
+_notifier_thread = None
+
+
+def enqueue_whatsapp(msg: str):
+    """
+    Enfileira a mensagem para envio assíncrono. Uma thread daemon junta tudo que chegou
+    em NOTIFY_FLUSH_SECONDS num único WhatsApp: uma queda em massa vira 1 envio, não N,
+    e quem chama (monitor, rotas) nunca espera pelo Twilio.
+    """
+    global _notifier_thread
+    if not (TWILIO_SID and TWILIO_AUTH):
+        logger.warning("⚠️ Twilio não configurado.")
+        return
+    with _notify_lock:
+        if len(_notify_queue) == _notify_queue.maxlen:
+            logger.warning("⚠️ Fila de WhatsApp cheia: descartando a notificação mais antiga.")
+        _notify_queue.append(msg)
+        if _notifier_thread is None or not _notifier_thread.is_alive():
+            _notifier_thread = threading.Thread(target=_notifier_loop, daemon=True, name="tok4-notify")
+            _notifier_thread.start()
+
+
+def flush_whatsapp_queue():
+    """Envia de uma vez o que estiver na fila (blocos de até WHATSAPP_MAX_BODY caracteres)."""
+    with _notify_lock:
+        # mesma mensagem repetida na janela (rajada de erros iguais) vai uma vez só
+        batch = list(dict.fromkeys(_notify_queue))
+        _notify_queue.clear()
+    chunk = ""
+    for msg in batch:
+        if chunk and len(chunk) + len(msg) + 2 > WHATSAPP_MAX_BODY:
+            send_whatsapp(chunk[:WHATSAPP_MAX_BODY])
+            chunk = ""
+        chunk = f"{chunk}\n\n{msg}" if chunk else msg
+    if chunk:
+        send_whatsapp(chunk[:WHATSAPP_MAX_BODY])
+
+
+def _notifier_loop():
+    while True:
+        time.sleep(NOTIFY_FLUSH_SECONDS)
+        try:
+            flush_whatsapp_queue()
+        except Exception as e:
+            logger.error(f"❌ Erro no envio da fila de WhatsApp: {e}")
 
 
 def carregar_links_typebot():
@@ -67,48 +325,231 @@ def carregar_links_typebot():
     if not TYPEBOT_API or not TYPEBOT_FLOW_ID:
         logger.warning("⚠️ TYPEBOT_API ou TYPEBOT_FLOW_ID não configurados.")
         return []
+    cache_key = f"tb:links:{TYPEBOT_FLOW_ID}"
+    cached = cache_get_json(cache_key)
+    if cached is not None:
+        return cached
     try:
         url = f"{TYPEBOT_API}/bots/{TYPEBOT_FLOW_ID}"
-        r = requests.get(url, timeout=10)
+        r = requests_session.get(url, timeout=10)
         r.raise_for_status()
-        data = r.json()
+        data = _json_loads(r.content)
         links = [
             block["content"]["url"]
             for block in data.get("blocks", [])
             if block.get("type") == "redirect"
         ]
+        cache_set_json(cache_key, links, TYPEBOT_LINKS_TTL)
         return links
     except Exception as e:
         logger.error(f"❌ Erro ao carregar links do Typebot: {e}")
-        send_whatsapp(f"⚠️ Erro ao carregar links do Typebot: {e}")
+        enqueue_whatsapp(f"⚠️ Erro ao carregar links do Typebot: {e}")
         return []
 
 # ================================
 # Funções de checagem (Token / URL / Probe / Webhook)
 # ================================
-def check_token(token: str):
-    """Valida o token do bot via /getMe."""
+def is_token_well_formed(token: str) -> bool:
+    """Pré-checagem local (µs) do formato do token, antes de qualquer chamada HTTP."""
+    return bool(token and _TOKEN_RE.match(token))
+
+
+def is_url_well_formed(url: str) -> bool:
+    """Pré-checagem local (µs) da redirect_url: esquema http(s) e host presentes."""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    return parts.scheme.lower() in _URL_SCHEMES and bool(parts.hostname) and not any(c.isspace() for c in url)
+
+
+def _token_key(token: str) -> str:
+    """Chave do cache de getMe: hash curto do token (tamanho fixo, 16 caracteres, qualquer que seja o token)."""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def invalidate_health_cache(token: str):
+    """Descarta o resultado em cache do token (ex.: após troca ativo/reserva)."""
+    with _health_cache_lock:
+        _health_cache.pop(_token_key(token), None)
+
+
+# ================================
+# Circuit breaker (chamadas à Bot API)
+# ================================
+class CircuitOpenError(Exception):
+    """Circuito aberto: a chamada nem sai para a rede."""
+
+
+class BulkheadFullError(Exception):
+    """Sem vaga no bulkhead do endpoint: saturação local, não falha do bot (resultado inconclusivo)."""
+
+
+class CircuitBreaker:
+    """
+    Breaker por chave (token): CLOSED → OPEN após `fail_threshold` falhas transitórias
+    seguidas (timeout, conexão, 429/5xx); depois de `recovery_sec` deixa passar uma
+    tentativa (HALF_OPEN) — sucesso fecha, falha reabre por mais uma janela.
+    """
+
+    def __init__(self, fail_threshold: int = 5, recovery_sec: float = 60):
+        self.fail_threshold = fail_threshold
+        self.recovery_sec = recovery_sec
+        self._state = LRUCache(maxsize=MAX_TRACKED_BOTS)  # key -> [falhas, aberto_em]
+        self._lock = threading.Lock()
+
+    def allow(self, key) -> bool:
+        with self._lock:
+            state = self._state.get(key)
+            if not state or state[0] < self.fail_threshold:
+                return True
+            now = time.monotonic()
+            if now - state[1] < self.recovery_sec:
+                return False
+            state[1] = now  # HALF_OPEN: só esta tentativa passa até o resultado chegar
+            return True
+
+    def record(self, key, ok: bool):
+        with self._lock:
+            if ok:
+                self._state.pop(key, None)
+                return
+            state = self._state.setdefault(key, [0, 0.0])
+            state[0] += 1
+            if state[0] >= self.fail_threshold:
+                state[1] = time.monotonic()
+
+
+# Um breaker por endpoint: getMe instável não bloqueia o probe (e vice-versa)
+_TG_BREAKERS = {
+    endpoint: CircuitBreaker(CIRCUIT_FAIL_THRESHOLD, CIRCUIT_RECOVERY_SECONDS)
+    for endpoint in ("getMe", "sendMessage", "getWebhookInfo")
+}
+_CIRCUIT_OPEN_REASON = "Circuito aberto (Telegram instável para este token), aguardando"
+
+# Bulkheads: o probe (sendMessage, sujeito a flood-wait) tem vagas próprias e não
+# ocupa as conexões/threads das consultas baratas (getMe/getWebhookInfo)
+_BH_PROBE = threading.BoundedSemaphore(TG_PROBE_CONCURRENCY)
+_BH_QUERY = threading.BoundedSemaphore(TG_QUERY_CONCURRENCY)
+_TG_BULKHEADS = {"sendMessage": _BH_PROBE, "getMe": _BH_QUERY, "getWebhookInfo": _BH_QUERY}
+
+
+@functools.lru_cache(maxsize=2048)
+def _tg_url(token: str, endpoint: str) -> str:
+    """URL da Bot API por (token, endpoint), montada uma vez e reaproveitada a cada ciclo."""
+    return f"{TELEGRAM_API}/bot{token}/{endpoint}"
+
+
+def _tg_call(method: str, token: str, endpoint: str, **kwargs):
+    """Chamada à Bot API passando pelo breaker do endpoint; CircuitOpenError se aberto."""
+    breaker = _TG_BREAKERS[endpoint]
+    if not breaker.allow(token):
+        raise CircuitOpenError(_CIRCUIT_OPEN_REASON)
+    bulkhead = _TG_BULKHEADS[endpoint]
+    if not bulkhead.acquire(timeout=TG_BULKHEAD_WAIT_SECONDS):
+        raise BulkheadFullError(f"Sem vaga para {endpoint} (bulkhead cheio), inconclusivo")
+    try:
+        r = requests_session.request(method, _tg_url(token, endpoint), **kwargs)
+    except requests.RequestException:
+        breaker.record(token, False)
+        raise
+    finally:
+        bulkhead.release()
+    # 401/403/404 são resposta definitiva e rápida: não contam para abrir o circuito
+    breaker.record(token, not (r.status_code == 429 or r.status_code >= 500))
+    return r
+
+
+def _invalidate_on_auth_error(token: str, status_code: int):
+    """401/403 da Bot API = token revogado: descarta o getMe em cache (TTL longo)."""
+    if status_code in (401, 403):
+        invalidate_health_cache(token)
+
+
+def check_token(token: str, use_cache: bool = True, timeout=None):
+    """
+    Valida o token do bot via /getMe.
+    Resultados OK ficam em cache por HEALTH_CACHE_TTL segundos e falhas por
+    HEALTH_CACHE_ERR_TTL (bem menor). Retentativas devem passar use_cache=False.
+    ok=None: inconclusivo (saturação local), não conta como falha do bot.
+    """
     if not token:
         return False, "Token vazio", None
+    if not is_token_well_formed(token):
+        return False, "Token com formato inválido", None
+    # bots que compartilham o token (staging/duplicados) caem na mesma entrada
+    key = _token_key(token)
+    if use_cache:
+        with _health_cache_lock:
+            cached = _health_cache.get(key)
+        if cached:
+            ttl = HEALTH_CACHE_TTL if cached[1][0] else HEALTH_CACHE_ERR_TTL
+            if time.monotonic() - cached[0] < ttl:
+                return cached[1]
+    result = _check_token_remote(token, timeout)
+    if result[0] is None:
+        return result  # inconclusivo (bulkhead cheio): não vira entrada de cache
+    ttl = HEALTH_CACHE_TTL if result[0] else HEALTH_CACHE_ERR_TTL
+    if ttl > 0:
+        with _health_cache_lock:
+            _health_cache[key] = (time.monotonic(), result)
+    else:
+        invalidate_health_cache(token)
+    return result
+
+
+def _check_token_remote(token: str, timeout=None):
     try:
-        url = f"https://api.telegram.org/bot{token}/getMe"
-        r = requests.get(url, timeout=8)
+        r = _tg_call("GET", token, "getMe", timeout=timeout or CHECK_TIMEOUTS)
         if r.status_code == 200:
-            data = r.json()
+            if _TG_OK_MARKER not in r.content:
+                return False, "Token inválido ou resposta inesperada", None
+            data = _json_loads(r.content)  # parse só no caminho OK, para extrair o username
             if data.get("ok") and "result" in data:
                 return True, "Token válido", data["result"].get("username")
             return False, "Token inválido ou resposta inesperada", None
         return False, f"Erro HTTP {r.status_code}", None
+    except CircuitOpenError:
+        return False, _CIRCUIT_OPEN_REASON, None
+    except BulkheadFullError as e:
+        return None, str(e), None
     except Exception as e:
         return False, f"Exceção: {e}", None
 
 
-def check_link(url: str):
-    """Verifica se a redirect_url responde HTTP válido (200–399)."""
+def check_link(url: str, timeout=None, use_cache: bool = True):
+    """
+    Verifica se a redirect_url responde HTTP válido (200–399).
+    URLs se repetem entre bots: resultado em cache por LINK_CACHE_TTL (falhas por HEALTH_CACHE_ERR_TTL).
+    """
     if not url:
         return False, "URL não definida"
+    if not is_url_well_formed(url):
+        return False, "URL com formato inválido"
+    if use_cache:
+        with _link_cache_lock:
+            cached = _link_cache.get(url)
+        if cached:
+            ttl = LINK_CACHE_TTL if cached[1][0] else HEALTH_CACHE_ERR_TTL
+            if time.monotonic() - cached[0] < ttl:
+                return cached[1]
+    result = _check_link_remote(url, timeout)
+    if (LINK_CACHE_TTL if result[0] else HEALTH_CACHE_ERR_TTL) > 0:
+        with _link_cache_lock:
+            _link_cache[url] = (time.monotonic(), result)
+    return result
+
+
+def _check_link_remote(url: str, timeout=None):
     try:
-        r = requests.get(url, timeout=8)
+        # HEAD basta para o status (sem baixar o corpo); GET só se o servidor recusar HEAD
+        timeout = timeout or CHECK_TIMEOUTS
+        r = requests_session.head(url, timeout=timeout, allow_redirects=True, headers=_LINK_HEADERS)
+        if r.status_code in (405, 501):
+            # stream=True: só status e headers; fechar sem ler devolve/descarta a conexão
+            # sem baixar a página inteira
+            r = requests_session.get(url, timeout=timeout, stream=True, headers=_LINK_HEADERS)
+            r.close()
         if 200 <= r.status_code < 400:
             return True, f"HTTP {r.status_code}"
         return False, f"HTTP {r.status_code}"
@@ -116,7 +557,7 @@ def check_link(url: str):
         return False, f"Exceção: {e}"
 
 
-def check_probe(token: str, chat_id: str):
+def check_probe(token: str, chat_id: str, timeout=None):
     """
     Envia mensagem no grupo de monitoramento para validar entrega.
     Retorna:
@@ -127,17 +568,22 @@ def check_probe(token: str, chat_id: str):
     if not token or not chat_id:
         return None, "Probe desativado (token/chat_id ausente)"
     try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
         payload = {"chat_id": chat_id, "text": "🔎 Probe check (TOK4 Monitor)"}
-        r = requests.post(url, json=payload, timeout=8)
-        if r.status_code == 200 and r.json().get("ok"):
+        r = _tg_call("POST", token, "sendMessage", json=payload, timeout=timeout or CHECK_TIMEOUTS)
+        _invalidate_on_auth_error(token, r.status_code)
+        # Só interessa o "ok": checagem em bytes, sem parsear o Message inteiro
+        if r.status_code == 200 and _TG_OK_MARKER in r.content:
             return True, "Mensagem entregue"
         return False, f"HTTP {r.status_code} / {r.text}"
+    except CircuitOpenError:
+        return False, _CIRCUIT_OPEN_REASON
+    except BulkheadFullError as e:
+        return None, str(e)
     except Exception as e:
         return False, f"Exceção: {e}"
 
 
-def check_webhook(token: str):
+def check_webhook(token: str, timeout=None):
     """
     Verifica estado do webhook via /getWebhookInfo.
     Retorna (ok: bool, reason: str, details: dict).
@@ -148,11 +594,11 @@ def check_webhook(token: str):
     if not token:
         return False, "Token vazio", {}
     try:
-        url = f"https://api.telegram.org/bot{token}/getWebhookInfo"
-        r = requests.get(url, timeout=8)
+        r = _tg_call("GET", token, "getWebhookInfo", timeout=timeout or CHECK_TIMEOUTS)
         if r.status_code != 200:
+            _invalidate_on_auth_error(token, r.status_code)
             return False, f"Erro HTTP {r.status_code}", {}
-        data = r.json()
+        data = _json_loads(r.content)
         if not data.get("ok"):
             return False, "Resposta inválida da API", data
         info = data.get("result", {})
@@ -165,29 +611,97 @@ def check_webhook(token: str):
             return True, "Webhook ativo e saudável", info
         else:
             return False, "Nenhum webhook configurado", info
+    except CircuitOpenError:
+        return False, _CIRCUIT_OPEN_REASON, {}
+    except BulkheadFullError as e:
+        return None, str(e), {}
     except Exception as e:
         return False, f"Exceção: {e}", {}
 
 # ================================
 # Diagnóstico centralizado
 # ================================
-def diagnosticar_bot(bot: Bot) -> dict:
+@functools.lru_cache(maxsize=1)
+def _diag_pool() -> ThreadPoolExecutor:
+    """Pool das checagens de diagnosticar_bot, criado no 1º uso (não em todo import/worker)."""
+    return ThreadPoolExecutor(max_workers=DIAG_POOL_WORKERS, thread_name_prefix="diag")
+
+
+_diag_timeouts = 0
+_diag_timeouts_lock = threading.Lock()
+
+
+class Deadline:
+    """Prazo absoluto (relógio monotônico) compartilhado por várias chamadas de rede."""
+
+    def __init__(self, budget_sec: float):
+        self.end = time.monotonic() + budget_sec
+
+    def remaining(self) -> float:
+        return max(0.0, self.end - time.monotonic())
+
+    def timeouts(self):
+        """(connect, read) para o requests, limitados ao que resta do prazo."""
+        rem = max(0.1, self.remaining())
+        return (min(HTTP_CONNECT_TIMEOUT, rem), rem)
+
+
+def diag_timeouts_total() -> int:
+    """Checagens do diagnóstico abandonadas por estourar o prazo (exposto em /metrics)."""
+    with _diag_timeouts_lock:
+        return _diag_timeouts
+
+
+def _diag_result(future, on_timeout, deadline: Deadline):
+    """Resultado de uma checagem do pool; timeout/exceção viram falha no mesmo formato da checagem."""
+    global _diag_timeouts
+    try:
+        return future.result(timeout=deadline.remaining())
+    except (FuturesTimeout, CancelledError):
+        # ainda na fila: sai dela e não ocupa worker do pool no próximo lote
+        # (já rodando não dá para interromper; termina no timeout do requests)
+        future.cancel()
+        with _diag_timeouts_lock:
+            _diag_timeouts += 1
+        return on_timeout
+    except Exception as e:
+        return (False, f"Exceção: {e}") + on_timeout[2:]
+
+
+def _run_diag(token: str, url: str, budget_sec: float = DIAG_BUDGET_SECONDS) -> dict:
     """
-    Executa todas as checagens: token, url, probe e webhook.
-    Atualiza diagnóstico no banco.
-    Retorna dict com status detalhado para dashboard e monitor.
+    Só as checagens de rede (sem ORM nem sessão): pode rodar em qualquer thread.
+    Token e URL saem juntos no pool; probe e webhook juntos, depois do token.
     """
-    token_ok, token_reason, username = check_token(bot.token or "")
-    url_ok, url_reason = check_link(bot.redirect_url or "")
-    probe_ok, probe_reason = check_probe(bot.token, MONITOR_CHAT_ID)
-    webhook_ok, webhook_reason, webhook_details = check_webhook(bot.token)
+    pool = _diag_pool()
+    dl = Deadline(budget_sec)
+    timeout = dl.timeouts()
+    ft_token = pool.submit(check_token, token or "", timeout=timeout)
+    ft_url = pool.submit(check_link, url or "", timeout=timeout)
+    token_ok, token_reason, username = _diag_result(ft_token, (False, "Timeout", None), dl)
+
+    # Token inválido: probe e webhook usam o mesmo token e falhariam com certeza — não saem
+    if token_ok is None:
+        probe_ok, probe_reason = None, "Pulado (token inconclusivo)"
+        webhook_ok, webhook_reason, webhook_details = None, "Pulado (token inconclusivo)", {}
+    elif token_ok:
+        timeout = dl.timeouts()
+        ft_probe = pool.submit(check_probe, token, MONITOR_CHAT_ID, timeout=timeout)
+        ft_webhook = pool.submit(check_webhook, token, timeout=timeout)
+        probe_ok, probe_reason = _diag_result(ft_probe, (False, "Timeout"), dl)
+        webhook_ok, webhook_reason, webhook_details = _diag_result(ft_webhook, (False, "Timeout", {}), dl)
+    else:
+        probe_ok, probe_reason = None, "Pulado (token inválido)"
+        webhook_ok, webhook_reason, webhook_details = False, "Pulado (token inválido)", {}
+    url_ok, url_reason = _diag_result(ft_url, (False, "Timeout"), dl)
 
     # 🔎 Lógica de decisão inteligente:
     # - Bot é considerado OK se token_ok e (probe_ok True/None).
     # - webhook_ok não derruba bot, só gera alerta.
-    decision_ok = token_ok and (probe_ok is True or probe_ok is None)
+    # - token inconclusivo (None) → decisão None: nem OK nem falha
+    decision_ok = None if token_ok is None else token_ok and (probe_ok is True or probe_ok is None)
 
-    diag = {
+    return {
         "token_ok": token_ok,
         "token_reason": token_reason,
         "username": username,
@@ -201,42 +715,52 @@ def diagnosticar_bot(bot: Bot) -> dict:
         "decision_ok": decision_ok
     }
 
+
+def _apply_and_log(bot: Bot, diag: dict):
+    """Aplica o diag no registro (sem commit) e registra o log detalhado."""
+    bot.apply_diag(diag)  # o model tira do diag completo as chaves que grava
+
+    status = "✅ OK" if diag["decision_ok"] else "❌ FALHA"
+    logger.info(
+        f"{status} {bot.name}: "
+        f"token={diag['token_ok']}, url={diag['url_ok']}, probe={diag['probe_ok']}, webhook={diag['webhook_ok']} "
+        f"| R: {diag['token_reason']} / {diag['url_reason']} / {diag['probe_reason']} / {diag['webhook_reason']} "
+        f"| webhook_info={diag['webhook_details']}"
+    )
+
+
+def diagnosticar_bot(bot: Bot, budget_sec: float = DIAG_BUDGET_SECONDS) -> dict:
+    """
+    Executa todas as checagens: token, url, probe e webhook.
+    Atualiza diagnóstico no banco.
+    Retorna dict com status detalhado para dashboard e monitor.
+    budget_sec: prazo único para as 4 checagens (timeouts derivados do que resta dele).
+    Cache só nas checagens (getMe/link em check_token/check_link), não no diag inteiro.
+    """
+    # Atributos lidos aqui, fora das threads do pool
+    diag = _run_diag(bot.token, bot.redirect_url, budget_sec)
+
     # Persistência no banco
     try:
-        bot.apply_diag({
-            "token_ok": token_ok,
-            "url_ok": url_ok,
-            "webhook_ok": webhook_ok,
-            "reason": f"T:{token_reason} | U:{url_reason} | P:{probe_reason} | W:{webhook_reason}"
-        })
+        _apply_and_log(bot, diag)
         db.session.commit()
     except SQLAlchemyError as e:
         db.session.rollback()
         logger.error(f"❌ Erro ao salvar diagnóstico do {bot.name}: {e}")
-
-    # Log detalhado
-    status = "✅ OK" if decision_ok else "❌ FALHA"
-    logger.info(
-        f"{status} {bot.name}: "
-        f"token={token_ok}, url={url_ok}, probe={probe_ok}, webhook={webhook_ok} "
-        f"| R: {token_reason} / {url_reason} / {probe_reason} / {webhook_reason} "
-        f"| webhook_info={webhook_details}"
-    )
-
     return diag
 
 # ================================
 # Log de eventos centralizado
 # ================================
 def log_event(bot: Bot, event: str, level: str = "info"):
-    """Centraliza logs e dispara alerta via WhatsApp se necessário."""
-    ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{ts}] {bot.name if bot else 'SYSTEM'}: {event}"
+    """Centraliza logs e dispara alerta via WhatsApp (fila assíncrona) se necessário."""
+    # timestamp fica com o %(asctime)s do handler; formatação % preguiçosa (nível filtrado = custo zero)
+    name = bot.name if bot else "SYSTEM"
     if level == "error":
-        logger.error(line)
-        send_whatsapp(f"❌ {event}")
+        logger.error("%s: %s", name, event)
+        enqueue_whatsapp(f"❌ {event}")
     elif level in ("warn", "warning"):
-        logger.warning(line)
-        send_whatsapp(f"⚠️ {event}")
+        logger.warning("%s: %s", name, event)
+        enqueue_whatsapp(f"⚠️ {event}")
     else:
-        logger.info(line)
\ No newline at end of file
+        logger.info("%s: %s", name, event)
\ No newline at end of file